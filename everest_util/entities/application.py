@@ -3,16 +3,17 @@ Class representation of an application object, as read from a docker-stack file
 """
 __author__ = 'tinglev@kth.se'
 
-import re
 import os
 import json
 import logging
 import hashlib
+from multiprocessing.pool import ThreadPool
 import yaml
 from everest_util.entities.service import Service
 from everest_util.entities.cluster import Cluster
 from everest_util.base_exception import EverestException
 from everest_util.regex import Regex
+from everest_util.version import Version
 from everest_util.json_encoder import ApplicationJsonEncoder
 
 class ApplicationException(EverestException):
@@ -217,7 +218,7 @@ class Application(object):
         Raises:
             ApplicationException: if unable to parse application name
         """
-        match = re.search(Regex.get_registry_app_and_cluster(), self._file_path)
+        match = Regex.get_compiled(Regex.get_registry_app_and_cluster()).search(self._file_path)
         if match:
             self._application_name = match.group(1)
             return
@@ -245,6 +246,92 @@ class Application(object):
         """
         services = self._get_stack_services()
         self.log.debug('Application has %i services', len(services))
+        image_tags = Application._index_image_tags(self._prefetch_image_tags(services))
         for name, service_struct in services:
             self._services.append(Service(self.registry)
-                                  .init_from_stack_service(name, service_struct))
+                                  .init_from_stack_service(name, service_struct, image_tags))
+
+    @staticmethod
+    def _index_image_tags(image_tags):
+        """
+        Indexes each prefetched tag list once, so that services sharing an image
+        share the index instead of each sorting the tags
+
+        Args:
+            image_tags: a dict as returned from _prefetch_image_tags()
+
+        Returns:
+            dict: the same keys, with the index from Version.create_index() (or the
+                  exception) as value
+        """
+        return dict((key, tags if isinstance(tags, Exception) else Version.create_index(tags))
+                    for key, tags in image_tags.items())
+
+    def _get_semver_images(self, services):
+        """
+        Finds all images that have a semver version (${ENV_KEY}) in the given services
+
+        Args:
+            services: an array of tuples as returned from _get_stack_services()
+
+        Returns:
+            array of tuples: the images on the format [(registry host, repository name), ..],
+                             where the registry host is None for images without one
+                             (see Regex.parse_registry_repository())
+        """
+        env_var_regex = Regex.get_compiled(Regex.get_env_var_dereference_regex())
+        images = []
+        for _, service_struct in services:
+            reference = Regex.parse_image_reference(service_struct.get('image', ''))
+            if reference and env_var_regex.match(reference[2]):
+                images.append(Regex.parse_registry_repository(reference[0], reference[1]))
+        return images
+
+    def _prefetch_image_tags(self, services):
+        """
+        Fetches the registry tags for all semver images in the given services
+        concurrently, so that the services don't have to call the registry
+        one after another. Images are fetched from the registry of their
+        registry host (see RegistryRouter), all hosts at the same time.
+
+        Args:
+            services: an array of tuples as returned from _get_stack_services()
+
+        Returns:
+            dict: (registry host, repository name) -> tags (or exception), as
+                  returned from Registry.get_image_tags_many()
+        """
+        names_per_host = {}
+        for host, image_name in self._get_semver_images(services):
+            names_per_host.setdefault(host, []).append(image_name)
+        if len(names_per_host) <= 1:
+            results = [self._fetch_host_image_tags(item) for item in names_per_host.items()]
+        else:
+            pool = ThreadPool(len(names_per_host))
+            try:
+                results = pool.map(self._fetch_host_image_tags, names_per_host.items())
+            finally:
+                pool.close()
+                pool.join()
+        image_tags = {}
+        for host_tags in results:
+            image_tags.update(host_tags)
+        return image_tags
+
+    def _fetch_host_image_tags(self, host_and_names):
+        """
+        Fetches the tags for the images of one registry host
+
+        Args:
+            host_and_names: a tuple of the registry host and its repository names
+
+        Returns:
+            dict: (registry host, repository name) -> tags (or exception)
+        """
+        host, image_names = host_and_names
+        try:
+            registry_tags = self.registry.get_registry(host).get_image_tags_many(image_names)
+        except EverestException as ex:
+            # Left to each service to raise, like a failed fetch of a single image
+            return dict(((host, image_name), ex) for image_name in image_names)
+        return dict(((host, image_name), tags) for image_name, tags in registry_tags.items())
@@ -3,7 +3,6 @@ Class representation of a cluster object
 """
 __author__ = 'tinglev@kth.se'
 
-import re
 import os
 import logging
 import json
@@ -155,7 +154,7 @@ class Cluster(object):
             ClusterException: if the cluster name was unable to be parsed
                               from the file path
         """
-        match = re.search(Regex.get_registry_app_and_cluster(), self._file_path)
+        match = Regex.get_compiled(Regex.get_registry_app_and_cluster()).search(self._file_path)
         if match:
             self._name = match.group(2)
             return
@@ -217,7 +216,7 @@ class Cluster(object):
         Returns:
             array of tuples: an array of tuples with the format [(env_key, env_val),..]
         """
-        env_regex = Regex.get_label_and_env_regex()
+        env_regex = Regex.get_compiled(Regex.get_label_and_env_regex())
         return [(line.split('=')[0], line.split('=')[1].rstrip('\n'))
                 for line in file_handle.readlines()
-                if re.match(env_regex, line)]
+                if env_regex.match(line)]
@@ -4,13 +4,12 @@ Class representation of a service object
 __author__ = 'tinglev@kth.se'
 
 import logging
-import re
 import json
 from everest_util.entities.image import Image
 from everest_util.entities.environment_list import EnvironmentList
 from everest_util.entities.label_list import LabelList
 from everest_util.regex import Regex
-from everest_util.version import Version
+from everest_util.version import Version, VersionIndex, VersionArray
 from everest_util.base_exception import EverestException
 from everest_util.json_encoder import ApplicationJsonEncoder
 
@@ -38,9 +37,10 @@ class Service(object):
         self._deploy_labels = LabelList()
         self._labels = LabelList()
         self.registry = registry
+        self._image_tags = None
         self.log = logging.getLogger(__name__)
 
-    def init_from_stack_service(self, name, service_struct):
+    def init_from_stack_service(self, name, service_struct, image_tags=None):
         """
         Initializes an instance of the class given a name and the parsed contents
         of a docker-stack file
@@ -48,6 +48,13 @@ class Service(object):
         Args:
             name: the name of the service
             service_struct: the parsed (as json) contents of a docker-stack file
+            image_tags: optional dict of prefetched registry tags, with
+                        (registry host, repository name) as key (see
+                        Regex.parse_registry_repository()) and the tags (or exception)
+                        returned by Registry.get_image_tags_many() as value. The tags
+                        may also be given as an index (see Version.create_index()),
+                        shared by all services with the same image. Images missing
+                        from the dict are fetched from the registry.
 
         Raises:
             ServiceException: on failure during initialization
@@ -55,6 +62,7 @@ class Service(object):
         self.log.debug('Initializing service with name "%s"', name)
         self._service_struct = service_struct
         self._name = name
+        self._image_tags = image_tags
         self._parse_image_info()
         self._parse_semver_version()
         self._fetch_semver_version()
@@ -168,7 +176,7 @@ class Service(object):
 
 
     def _is_valid_label(self, label):
-        return re.match(Regex.get_label_and_env_regex(), label)
+        return Regex.get_compiled(Regex.get_label_and_env_regex()).match(label)
 
     def _parse_deploy_labels(self):
         try:
@@ -214,14 +222,29 @@ class Service(object):
         if self._image.get_is_semver():
             semver_version = self._get_env_value_from_struct(self._image.get_version_env_key())
             self.log.debug('Semver version before lookup is "%s"', semver_version)
-            registry_tags = self.registry.get_image_tags(self._image.get_name())
-            self.log.debug('Got tags from registry: "%s"', registry_tags)
-            valid_versions = Version.get_sorted_valid_versions(registry_tags)
-            self.log.debug('After sort and validation: "%s"', valid_versions)
-            final_semver_version = Version.get_best_semver_match(valid_versions, semver_version)
+            registry_tags = self._get_registry_tags()
+            if isinstance(registry_tags, (VersionIndex, VersionArray)):
+                final_semver_version = registry_tags.best_match(semver_version)
+            else:
+                self.log.debug('Got tags from registry: "%s"', registry_tags)
+                valid_versions = Version.get_sorted_valid_versions(registry_tags)
+                self.log.debug('After sort and validation: "%s"', valid_versions)
+                final_semver_version = Version.get_best_semver_match(valid_versions,
+                                                                     semver_version)
             self.log.debug('Setting semver version to "%s"', final_semver_version)
             self._image.set_semver_version(final_semver_version)
 
+    def _get_registry_tags(self):
+        image_key = Regex.parse_registry_repository(self._image.get_registry(),
+                                                    self._image.get_name())
+        if self._image_tags and image_key in self._image_tags:
+            registry_tags = self._image_tags[image_key]
+            if isinstance(registry_tags, Exception):
+                raise registry_tags
+            return registry_tags
+        host, repository = image_key
+        return self.registry.get_registry(host).get_image_tags(repository)
+
     def _get_env_value_from_struct(self, env_key):
         try:
             return self._service_struct['environment'][env_key]
@@ -232,8 +255,8 @@ class Service(object):
                                    .format(env_key, self._name), ex=key_err)
 
     def _parse_semver_version(self):
-        match = re.match(Regex.get_env_var_dereference_regex(),
-                         self._image.get_static_version())
+        match = (Regex.get_compiled(Regex.get_env_var_dereference_regex())
+                 .match(self._image.get_static_version()))
         if match:
             self.log.debug('Service has semver version "%s" with env key "%s"',
                            self._image.get_static_version(), match.group(1))
@@ -256,17 +279,17 @@ class Service(object):
                                    .format(self._name), key_err)
 
     def _parse_image_registry(self, image):
-        match = re.match(Regex.get_image_and_registry_regex(), image)
-        if match:
-            self._image.set_registry(match.group(1))
+        reference = Regex.parse_image_reference(image)
+        if reference and reference[0]:
+            self._image.set_registry(reference[0])
             return
         self._image.set_registry(None)
         self.log.debug('Image is external (contains no registry)')
 
     def _parse_image_name(self, image):
-        match = re.match(Regex.get_image_parts_regex(), image)
-        if match:
-            self._image.set_name(match.group(2))
+        reference = Regex.parse_image_reference(image)
+        if reference:
+            self._image.set_name(reference[1])
             return
         self.log.debug('Could not parse image name from image section: "%s"',
                        image)
@@ -274,9 +297,9 @@ class Service(object):
                                .format(image))
 
     def _parse_image_version(self, image):
-        match = re.match(Regex.get_image_parts_regex(), image)
-        if match:
-            self._image.set_static_version(match.group(3))
+        reference = Regex.parse_image_reference(image)
+        if reference:
+            self._image.set_static_version(reference[2])
             return
         self.log.debug('Could not parse image name from image section: "%s"',
                        image)
@@ -0,0 +1,262 @@
+"""
+Module with helpers for controlling the flow of requests to external systems
+"""
+__author__ = 'tinglev@kth.se'
+
+import time
+import threading
+from collections import deque, OrderedDict
+
+class AdaptiveLimiter(object):
+    """
+    Concurrency limiter with additive increase, multiplicative decrease (AIMD).
+    The limit grows by one for every limit number of successful requests and is
+    cut by the backoff factor when the remote system reports that it is
+    overloaded. A Retry-After from the remote system blocks all new requests
+    until it has passed.
+    """
+
+    def __init__(self, initial_limit=10, min_limit=1, max_limit=100, backoff_factor=0.5):
+        """
+        Constructor
+
+        Args:
+            initial_limit: the number of concurrent requests allowed to start with
+            min_limit: the limit is never decreased below this
+            max_limit: the limit is never increased above this
+            backoff_factor: the limit is multiplied with this on overload
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_factor = backoff_factor
+        self.in_flight = 0
+        self._blocked_until = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """
+        Waits until a request is allowed to start
+
+        Args:
+            timeout: the max number of seconds to wait, None waits forever
+
+        Returns:
+            bool: True if the request may start (and release() must be called
+                  when it is done), False if the timeout expired
+        """
+        give_up_at = time.time() + timeout if timeout is not None else None
+        with self._condition:
+            while True:
+                now = time.time()
+                wait = None
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return True
+                if give_up_at is not None:
+                    if now >= give_up_at:
+                        return False
+                    wait = min(wait, give_up_at - now) if wait else give_up_at - now
+                self._condition.wait(wait)
+
+    def release(self, overloaded=False, retry_after=None):
+        """
+        Marks a request as done and adjusts the limit
+
+        Args:
+            overloaded: True if the remote system reported overload (for instance
+                        status code 429 or 503) or the request timed out
+            retry_after: seconds the remote system asked us to wait, or None
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(float(self.min_limit), self.limit * self.backoff_factor)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, time.time() + retry_after)
+            self._condition.notify_all()
+
+
+class LatencyTracker(object):
+    """
+    Keeps the latencies of the most recent requests, to calculate percentiles
+    """
+
+    def __init__(self, size=200, min_samples=20):
+        """
+        Constructor
+
+        Args:
+            size: the number of latencies to keep
+            min_samples: the number of latencies needed before percentiles are calculated
+        """
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency):
+        """
+        Adds the latency of a request
+
+        Args:
+            latency: the latency in seconds
+        """
+        with self._lock:
+            self._latencies.append(latency)
+
+    def get_percentile(self, percentile):
+        """
+        Args:
+            percentile: the percentile to calculate (for instance 95)
+
+        Returns:
+            float: the latency at the given percentile, or None if there are
+                   not enough latencies yet
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100.0))
+        return latencies[index]
+
+
+class TokenBucket(object):
+    """
+    Rate limiter that lets requests through at a steady rate, with bursts of up
+    to capacity requests. A Retry-After from the remote system pauses it.
+    """
+
+    def __init__(self, rate=1.0, capacity=1):
+        """
+        Constructor
+
+        Args:
+            rate: the number of requests per second
+            capacity: the max number of requests let through at once, after a
+                      period without requests
+        """
+        self.rate = float(rate)
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """
+        Waits until a request is allowed by the rate
+
+        Args:
+            timeout: the max number of seconds to wait, None waits forever
+
+        Returns:
+            bool: True if the request may be sent, False if it wouldn't be
+                  allowed within the timeout (returned without waiting)
+        """
+        give_up_at = time.time() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                now = time.time()
+                self._refill(now)
+                if now >= self._updated_at and self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = max(self._updated_at - now, 0) + (1 - self._tokens) / self.rate
+            if give_up_at is not None and now + wait > give_up_at:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Lets no requests through for the given number of seconds, after which one
+        request is let through and the rate applies again
+
+        Args:
+            seconds: the number of seconds to pause (for instance a Retry-After)
+        """
+        with self._lock:
+            self._updated_at = max(self._updated_at, time.time() + seconds)
+            self._tokens = 1.0
+
+    def _refill(self, now):
+        if now > self._updated_at:
+            self._tokens = min(float(self.capacity),
+                               self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+
+
+class DuplicateFilter(object):
+    """
+    Remembers the keys seen within a time window, in a size bounded set, to
+    suppress duplicates. The number of suppressed duplicates is counted per
+    group (for instance per channel), so it can be reported later.
+    """
+
+    def __init__(self, window=60, max_size=1024):
+        """
+        Constructor
+
+        Args:
+            window: the number of seconds a key is remembered after it was first seen
+            max_size: the max number of keys remembered, the oldest key is forgotten
+                      when there are more
+        """
+        self.window = window
+        self.max_size = max_size
+        self._seen = OrderedDict()
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, key, group=None):
+        """
+        Checks if a key was seen within the window, and remembers it if it wasn't
+
+        Args:
+            key: the key, for instance a hash of a message
+            group: the group to count a suppressed duplicate in
+
+        Returns:
+            bool: True if the key is a duplicate
+        """
+        now = time.time()
+        with self._lock:
+            while self._seen:
+                oldest_key, seen_at = next(self._seen.iteritems())
+                if seen_at > now - self.window:
+                    break
+                del self._seen[oldest_key]
+            if key in self._seen:
+                self._suppressed[group] = self._suppressed.get(group, 0) + 1
+                return True
+            self._seen[key] = now
+            if len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return False
+
+    def forget(self, key):
+        """
+        Forgets a key, so that it isn't a duplicate the next time it is seen
+        """
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def take_suppressed(self, group=None):
+        """
+        Returns:
+            int: the number of duplicates suppressed in the group since the last
+                 call, the count is reset
+        """
+        with self._lock:
+            return self._suppressed.pop(group, 0)
+
+    def add_suppressed(self, count, group=None):
+        """
+        Adds back a count returned by take_suppressed() that couldn't be reported
+        """
+        if count:
+            with self._lock:
+                self._suppressed[group] = self._suppressed.get(group, 0) + count
@@ -3,11 +3,80 @@ Module containing various regex patterns used with the everest ecosystem
 """
 __author__ = 'tinglev@kth.se'
 
+import re
+
 class Regex(object):
     """
     Static class containing the regex patterns
     """
 
+    _compiled = {}
+    _image_references = {}
+    _IMAGE_REFERENCE_CACHE_MAX_SIZE = 10000
+
+    @staticmethod
+    def get_compiled(regex):
+        """
+        Returns the compiled pattern object for one of the regex patterns in this
+        class. Each pattern is compiled once and then reused.
+
+        Example:
+            Regex.get_compiled(Regex.get_static_version_regex()).match('1.2.3')
+        """
+        try:
+            return Regex._compiled[regex]
+        except KeyError:
+            pattern = Regex._compiled[regex] = re.compile(regex)
+            return pattern
+
+    @staticmethod
+    def parse_image_reference(image):
+        """
+        Parses an image reference into its registry, name and version with a single
+        match against Regex.get_image_reference_regex(). Results are memoized per
+        image string, since the same image reference is repeated across clusters.
+
+        Returns:
+            tuple: (registry, name, version), where registry is None for images
+                   without a registry, or None if the image could not be parsed
+
+        Valid examples:
+            private.registry.kth.se/dizin:1.2.23_abcdefg -> ('private.registry.kth.se',
+                                                             'dizin', '1.2.23_abcdefg')
+            redis:4.0 -> (None, 'redis', '4.0')
+        """
+        try:
+            return Regex._image_references[image]
+        except KeyError:
+            pass
+        match = Regex.get_compiled(Regex.get_image_reference_regex()).match(image)
+        reference = match.groups() if match else None
+        if len(Regex._image_references) >= Regex._IMAGE_REFERENCE_CACHE_MAX_SIZE:
+            Regex._image_references.clear()
+        Regex._image_references[image] = reference
+        return reference
+
+    @staticmethod
+    def parse_registry_repository(registry, name):
+        """
+        Splits the registry part of an image reference at the first '/' into the
+        registry host and a repository path, which belongs to the repository name
+        used in the registry api
+
+        Returns:
+            tuple: (registry host, repository name), where the registry host is
+                   None for images without a registry
+
+        Valid examples:
+            ('private.registry.kth.se', 'dizin') -> ('private.registry.kth.se', 'dizin')
+            ('host:5000/team', 'app') -> ('host:5000', 'team/app')
+            (None, 'redis') -> (None, 'redis')
+        """
+        if not registry:
+            return (None, name)
+        host, _, path = registry.partition('/')
+        return (host, '{}/{}'.format(path, name) if path else name)
+
     @staticmethod
     def get_label_and_env_regex():
         """
@@ -62,6 +131,22 @@ class Regex(object):
         """
         return r'^(.+/){0,1}(.+):(.+)$'
 
+    @staticmethod
+    def get_image_reference_regex():
+        """
+        Matches the registry, name and version of an image. Combines
+        get_image_and_registry_regex() and get_image_parts_regex().
+        Groups:
+            1: registry (None if missing)
+            2: name
+            3: version
+
+        Valid examples:
+            private.registry.kth.se/dizin:1.2.23_abcdefg
+            redis:4.0
+        """
+        return r'^(?:(.+)/)?(.+):(.+)$'
+
     @staticmethod
     def get_semver_version_regex():
         """
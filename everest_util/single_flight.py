@@ -0,0 +1,105 @@
+"""
+Module for coalescing concurrent identical calls into one
+"""
+__author__ = 'tinglev@kth.se'
+
+import threading
+from everest_util.base_exception import EverestException
+
+class SingleFlightTimeoutException(EverestException):
+    """
+    Exception raised when a caller gives up waiting for a call in flight
+    """
+    pass
+
+class _Call(object):
+    """
+    A call in flight, shared by all callers with the same key
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight(object):
+    """
+    Makes sure that only one call per key is executing at any time. Callers that
+    arrive while a call with the same key is in flight wait for it and share its
+    result (or exception) instead of making a call of their own.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Calls func(*args, **kwargs), unless a call with the same key is already
+        in flight, in which case its result is waited for and returned
+
+        Args:
+            key: the key identifying identical calls
+            func: the function to call
+
+        Returns:
+            the return value of the function
+
+        Raises:
+            the exception raised by the function
+        """
+        return self.do_within(key, None, func, *args, **kwargs)
+
+    def do_within(self, key, timeout, func, *args, **kwargs):
+        """
+        Like do(), but a caller that joins a call in flight waits for it at most
+        timeout seconds. The call itself is not affected, so func should enforce
+        the timeout for the caller that makes it.
+
+        Args:
+            key: the key identifying identical calls
+            timeout: the max number of seconds to wait for a call in flight,
+                     None waits forever
+            func: the function to call
+
+        Returns:
+            the return value of the function
+
+        Raises:
+            SingleFlightTimeoutException: if the call in flight didn't finish in time
+            the exception raised by the function
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+        if not is_leader:
+            if not call.done.wait(timeout):
+                raise SingleFlightTimeoutException('Gave up waiting for call in flight '
+                                                   'for "{}"'.format(key))
+            if call.exception:
+                raise call.exception
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as ex:
+            call.exception = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        """
+        Returns:
+            int: the number of calls currently in flight
+        """
+        with self._lock:
+            return len(self._calls)
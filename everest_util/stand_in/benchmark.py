@@ -0,0 +1,176 @@
+"""
+Load benchmarks for the Registry and Slack clients, run against the in-process
+stand-in servers
+
+Usage:
+    python -m everest_util.stand_in.benchmark --calls 2000 --concurrency 16
+"""
+__author__ = 'tinglev@kth.se'
+
+import time
+import argparse
+from multiprocessing.pool import ThreadPool
+from everest_util.base_exception import EverestException
+from everest_util.systems.registry import Registry
+from everest_util.systems.slack import Slack
+from everest_util.stand_in.registry_server import FakeRegistryServer
+from everest_util.stand_in.slack_server import FakeSlackServer
+
+class BenchmarkResult(object):
+    """
+    Latencies and errors of one benchmark run
+    """
+
+    def __init__(self, name, latencies, errors, seconds):
+        """
+        Constructor
+
+        Args:
+            name: the name of the benchmark
+            latencies: the latency in seconds of every successful call
+            errors: the number of failed calls
+            seconds: the wall time of the whole run
+        """
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.seconds = seconds
+
+    def get_percentile(self, percentile):
+        """
+        Args:
+            percentile: the percentile to calculate (for instance 99)
+
+        Returns:
+            float: the latency in seconds at the percentile, or None without latencies
+        """
+        if not self.latencies:
+            return None
+        index = min(len(self.latencies) - 1, int(len(self.latencies) * percentile / 100.0))
+        return self.latencies[index]
+
+    def get_report(self):
+        """
+        Returns:
+            dict: number of calls, errors, throughput (calls per second) and the
+                  p50/p99 latencies in milliseconds
+        """
+        calls = len(self.latencies) + self.errors
+        return dict(name=self.name, calls=calls, errors=self.errors,
+                    throughput=calls / self.seconds if self.seconds else 0.0,
+                    p50_ms=(self.get_percentile(50) or 0) * 1000,
+                    p99_ms=(self.get_percentile(99) or 0) * 1000)
+
+    def __str__(self):
+        """
+        ToString override
+        """
+        return ('{name}: {calls} calls, {errors} errors, {throughput:.1f} calls/s, '
+                'p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms'.format(**self.get_report()))
+
+
+def run_benchmark(name, func, args_list, concurrency):
+    """
+    Calls func once for every argument in args_list, on a pool of threads,
+    and measures each call
+
+    Args:
+        name: the name of the benchmark
+        func: the function to benchmark, taking one argument
+        args_list: the arguments to call func with
+        concurrency: the number of threads making calls
+
+    Returns:
+        BenchmarkResult: the result of the run
+    """
+    def timed_call(arg):
+        started = time.time()
+        try:
+            func(arg)
+            return time.time() - started
+        except EverestException:
+            return None
+    pool = ThreadPool(concurrency)
+    started = time.time()
+    try:
+        durations = pool.map(timed_call, args_list)
+    finally:
+        pool.close()
+        pool.join()
+    seconds = time.time() - started
+    latencies = [duration for duration in durations if duration is not None]
+    return BenchmarkResult(name, latencies, len(durations) - len(latencies), seconds)
+
+
+def run_registry_benchmark(calls=500, concurrency=8, images=10, tags_per_image=1000,
+                           latency=0, max_page_size=None, throttle_every=0):
+    """
+    Benchmarks Registry.get_image_tags against a FakeRegistryServer
+
+    Returns:
+        BenchmarkResult: the result of the run
+    """
+    tag_counts = dict(('image-{}'.format(i), tags_per_image) for i in range(images))
+    with FakeRegistryServer(tag_counts, max_page_size=max_page_size, latency=latency,
+                            throttle_every=throttle_every, retry_after=0) as server:
+        registry = Registry('', '', server.get_base_url(), pool_size=concurrency)
+        names = [sorted(tag_counts)[i % images] for i in range(calls)]
+        try:
+            return run_benchmark('registry', registry.get_image_tags, names, concurrency)
+        finally:
+            registry.close()
+
+
+def run_slack_benchmark(calls=200, concurrency=4, channels=10, latency=0, rate_limit=0,
+                        client_rate=None, max_retries=3):
+    """
+    Benchmarks Slack.call_slack_endpoint against a FakeSlackServer, with the
+    client rate limited to client_rate messages per second (if given), and
+    retrying rate limited messages max_retries times
+
+    Returns:
+        BenchmarkResult: the result of the run
+    """
+    with FakeSlackServer(rate_limit=rate_limit, latency=latency) as server:
+        slack = Slack(server.get_webhook_url(), rate=client_rate, max_retries=max_retries,
+                      pool_size=concurrency)
+        payloads = [slack.create_payload_body('#channel-{}'.format(i % channels),
+                                              'Benchmark message {}'.format(i),
+                                              'benchmark', ':+1:')
+                    for i in range(calls)]
+        try:
+            return run_benchmark('slack', slack.call_slack_endpoint, payloads, concurrency)
+        finally:
+            slack.close()
+
+
+def main():
+    """
+    Runs the benchmarks and prints the results
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the Registry and Slack clients')
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--images', type=int, default=10)
+    parser.add_argument('--tags', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=None)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='simulated server latency in seconds')
+    parser.add_argument('--throttle-every', type=int, default=0,
+                        help='answer every n:th registry request with 429')
+    parser.add_argument('--slack-rate-limit', type=int, default=0,
+                        help='messages per channel and second, 0 disables the limit')
+    parser.add_argument('--slack-client-rate', type=float, default=None,
+                        help='messages per second the Slack client limits itself to')
+    parser.add_argument('--slack-retries', type=int, default=3,
+                        help='times the Slack client resends a rate limited message')
+    args = parser.parse_args()
+    print(run_registry_benchmark(args.calls, args.concurrency, args.images, args.tags,
+                                 args.latency, args.page_size, args.throttle_every))
+    print(run_slack_benchmark(args.calls, args.concurrency, latency=args.latency,
+                              rate_limit=args.slack_rate_limit,
+                              client_rate=args.slack_client_rate,
+                              max_retries=args.slack_retries))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Stand-in for a docker registry (v2 api), serving generated tag lists
+"""
+__author__ = 'tinglev@kth.se'
+
+import re
+import time
+import bisect
+import hashlib
+import urllib
+import urlparse
+from everest_util.stand_in.server import StandInServer
+
+class FakeRegistryServer(StandInServer):
+    """
+    Serves /v2/<image>/tags/list and /v2/_catalog with n/last pagination, Link
+    headers and ETags, with configurable latency and 429 throttling
+    """
+
+    TAGS_PATH_REGEX = r'^/v2/(.+)/tags/list$'
+    CATALOG_PATH = '/v2/_catalog'
+
+    def __init__(self, tag_counts=None, max_page_size=None, latency=0, etags=True,
+                 throttle_every=0, retry_after=1, port=0):
+        """
+        Constructor
+
+        Args:
+            tag_counts: a dict of image name -> number of tags to generate for it
+            max_page_size: the max number of tags/repositories per page, None returns
+                           everything unless the client asks for pages (n=)
+            latency: seconds to wait before answering each request
+            etags: if True, send ETag headers and answer If-None-Match with 304
+            throttle_every: answer every n:th request with 429, 0 never throttles
+            retry_after: the Retry-After header sent with 429 responses
+            port: the port to listen on, 0 picks a free port
+        """
+        super(FakeRegistryServer, self).__init__(port)
+        self.max_page_size = max_page_size
+        self.latency = latency
+        self.etags = etags
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self._tags = dict((name, FakeRegistryServer.generate_tags(count))
+                          for name, count in (tag_counts or {'kth-azure-app': 100}).items())
+        self._repositories = sorted(self._tags)
+
+    @staticmethod
+    def generate_tags(count):
+        """
+        Generates tags on the format major.minor.build_hash
+
+        Args:
+            count: the number of tags to generate
+
+        Returns:
+            array: the tags, sorted lexically (as returned by docker registries)
+        """
+        return sorted('{}.{}.{}_{}'.format(i // 10000, (i // 100) % 100, i % 100,
+                                           hashlib.sha1(str(i)).hexdigest()[:7])
+                      for i in range(count))
+
+    def get_tags(self, image_name):
+        """
+        Returns:
+            array: all tags served for the image, or None for unknown images
+        """
+        return self._tags.get(image_name)
+
+    def handle(self, handler, method, count):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttle_every and count % self.throttle_every == 0:
+            handler.respond(429, {'errors': [{'code': 'TOOMANYREQUESTS'}]},
+                            {'Retry-After': str(self.retry_after)})
+            return
+        url = urlparse.urlparse(handler.path)
+        query = urlparse.parse_qs(url.query)
+        match = re.match(FakeRegistryServer.TAGS_PATH_REGEX, url.path)
+        if method == 'GET' and url.path == FakeRegistryServer.CATALOG_PATH:
+            self._respond_with_page(handler, url.path, query, 'repositories',
+                                    self._repositories)
+        elif method == 'GET' and match and match.group(1) in self._tags:
+            self._respond_with_page(handler, url.path, query, 'tags',
+                                    self._tags[match.group(1)], match.group(1))
+        else:
+            handler.respond(404, {'errors': [{'code': 'NAME_UNKNOWN'}]})
+
+    def _respond_with_page(self, handler, path, query, field, items, image_name=None):
+        page_size = int(query['n'][0]) if 'n' in query else None
+        if self.max_page_size:
+            page_size = min(page_size or self.max_page_size, self.max_page_size)
+        start = bisect.bisect_right(items, query['last'][0]) if 'last' in query else 0
+        end = start + page_size if page_size else len(items)
+        page = items[start:end]
+        body = {field: page}
+        if image_name:
+            body['name'] = image_name
+        headers = {}
+        if end < len(items):
+            headers['Link'] = '<{}?{}>; rel="next"'.format(
+                path, urllib.urlencode([('n', page_size), ('last', page[-1])]))
+        if self.etags:
+            etag = '"{}"'.format(hashlib.sha1('{}|{}|{}'.format(path, len(items), start))
+                                 .hexdigest())
+            headers['ETag'] = etag
+            if handler.headers.getheader('If-None-Match') == etag:
+                handler.respond(304, headers=headers)
+                return
+        handler.respond(200, body, headers)
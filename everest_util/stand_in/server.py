@@ -0,0 +1,154 @@
+"""
+Base class for in-process stand-in http servers, used to test and benchmark
+the clients in everest_util.systems without live services
+"""
+__author__ = 'tinglev@kth.se'
+
+import json
+import logging
+import threading
+import BaseHTTPServer
+import SocketServer
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Request handler that passes requests on to the stand-in server
+    """
+
+    # Keep-alive, so that connection pooling in the clients is exercised
+    protocol_version = 'HTTP/1.1'
+    # Buffer each response into a single write, so that delayed acks don't stall it
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self): # pylint: disable=C0103
+        """
+        Handles GET requests
+        """
+        self.server.stand_in.handle_request(self, 'GET')
+
+    def do_POST(self): # pylint: disable=C0103
+        """
+        Handles POST requests
+        """
+        self.server.stand_in.handle_request(self, 'POST')
+
+    def read_body(self):
+        """
+        Returns:
+            string: the request body
+        """
+        length = int(self.headers.getheader('Content-Length') or 0)
+        return self.rfile.read(length) if length else ''
+
+    def respond(self, status, body=None, headers=None):
+        """
+        Sends a response
+
+        Args:
+            status: the http status code
+            body: a string, or an object to send as json
+            headers: a dict of extra headers
+        """
+        if body is not None and not isinstance(body, basestring):
+            body = json.dumps(body)
+            headers = dict(headers or {})
+            headers.setdefault('Content-Type', 'application/json')
+        body = body or ''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=W0622
+        """
+        Logs requests at debug level instead of to stderr
+        """
+        logging.getLogger(__name__).debug(format, *args)
+
+
+class StandInServer(object):
+    """
+    A threaded http server on localhost, running in a background thread
+    """
+
+    def __init__(self, port=0):
+        """
+        Constructor
+
+        Args:
+            port: the port to listen on, 0 picks a free port
+        """
+        self.port = port
+        self.request_count = 0
+        self._server = None
+        self._thread = None
+        self._count_lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+
+    def start(self):
+        """
+        Starts the server
+
+        Returns:
+            self: for chaining purposes
+        """
+        self._server = _ThreadingHTTPServer(('127.0.0.1', self.port), StandInHandler)
+        self._server.stand_in = self
+        self.port = self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.log.debug('%s listening on %s', type(self).__name__, self.get_base_url())
+        return self
+
+    def stop(self):
+        """
+        Stops the server
+        """
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def get_base_url(self):
+        """
+        Returns:
+            string: the base url of the server (for instance http://127.0.0.1:34567)
+        """
+        return 'http://127.0.0.1:{}'.format(self.port)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def handle_request(self, handler, method):
+        """
+        Counts the request and passes it on to handle()
+        """
+        with self._count_lock:
+            self.request_count += 1
+            count = self.request_count
+        self.handle(handler, method, count)
+
+    def handle(self, handler, method, count):
+        """
+        Handles a request, implemented by the stand-in servers
+
+        Args:
+            handler: the StandInHandler for the request
+            method: 'GET' or 'POST'
+            count: the number of this request, starting at 1
+        """
+        raise NotImplementedError
@@ -0,0 +1,81 @@
+"""
+Stand-in for a Slack incoming webhook
+"""
+__author__ = 'tinglev@kth.se'
+
+import json
+import math
+import time
+import threading
+from collections import deque
+from everest_util.stand_in.server import StandInServer
+
+class FakeSlackServer(StandInServer):
+    """
+    Accepts webhook payloads on any path and keeps them, rate limited per
+    channel the way Slack does it (429 with Retry-After)
+    """
+
+    def __init__(self, rate_limit=1, rate_period=1.0, latency=0, port=0):
+        """
+        Constructor
+
+        Args:
+            rate_limit: the number of messages accepted per channel and rate period,
+                        0 disables rate limiting
+            rate_period: the length of the rate period in seconds
+            latency: seconds to wait before answering each request
+            port: the port to listen on, 0 picks a free port
+        """
+        super(FakeSlackServer, self).__init__(port)
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self.latency = latency
+        self.received = []
+        self.throttled = 0
+        self._sent_at = {}
+        self._lock = threading.Lock()
+
+    def get_webhook_url(self):
+        """
+        Returns:
+            string: the webhook url to give to the Slack class
+        """
+        return '{}/services/stand-in/webhook'.format(self.get_base_url())
+
+    def handle(self, handler, method, count):
+        if self.latency:
+            time.sleep(self.latency)
+        if method != 'POST':
+            handler.respond(405, 'invalid_method')
+            return
+        try:
+            payload = json.loads(handler.read_body())
+        except ValueError:
+            handler.respond(400, 'invalid_payload')
+            return
+        retry_after = self._throttle(payload.get('channel', ''))
+        if retry_after:
+            handler.respond(429, 'rate_limited', {'Retry-After': str(retry_after)})
+            return
+        with self._lock:
+            self.received.append(payload)
+        handler.respond(200, 'ok')
+
+    def _throttle(self, channel):
+        """
+        Returns:
+            int: seconds to wait before the channel accepts another message, or 0
+                 if the message was accepted
+        """
+        now = time.time()
+        with self._lock:
+            if self.rate_limit:
+                sent_at = self._sent_at.setdefault(channel, deque())
+                while sent_at and sent_at[0] <= now - self.rate_period:
+                    sent_at.popleft()
+                if len(sent_at) >= self.rate_limit:
+                    self.throttled += 1
+                    return int(math.ceil(sent_at[0] + self.rate_period - now)) or 1
+                sent_at.append(now)
+            return 0
@@ -0,0 +1,176 @@
+"""
+Module to handle docker registry requests without blocking the caller
+
+This library targets Python 2, where asyncio is not available. Requests are
+instead queued and executed by a fixed number of worker threads, so that the
+number of threads (and concurrent requests to the registry) stays constant
+regardless of how many requests are made.
+"""
+__author__ = 'tinglev@kth.se'
+
+import logging
+import threading
+import Queue
+from everest_util.systems.registry import Registry, RegistryHTTPException
+
+class TagRequest(object):
+    """
+    The pending result of AsyncRegistry.get_image_tags()
+    """
+
+    def __init__(self, image_name):
+        """
+        Constructor
+
+        Args:
+            image_name: the name of the image to get tags for
+        """
+        self.image_name = image_name
+        self._tags = None
+        self._exception = None
+        self._cancelled = False
+        self._started = False
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """
+        Cancels the request, if it has not been sent to the registry yet
+
+        Returns:
+            bool: True if the request was cancelled
+        """
+        with self._lock:
+            if self._started:
+                return self._cancelled
+            self._cancelled = True
+        self._done.set()
+        return True
+
+    def cancelled(self):
+        """
+        Returns:
+            bool: True if the request was cancelled
+        """
+        return self._cancelled
+
+    def done(self):
+        """
+        Returns:
+            bool: True if the request has finished, failed or was cancelled
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the tags of the image
+
+        Args:
+            timeout: the max number of seconds to wait, None waits forever
+
+        Returns:
+            json array: an array with all tags for the image
+
+        Raises:
+            RegistryImageException: on no tags found or parse error of tags
+            RegistryHTTPException: on http errors, if the request was cancelled
+                                   or if the timeout expired
+        """
+        if not self._done.wait(timeout):
+            raise RegistryHTTPException('Timed out waiting for tags of image "{}"'
+                                        .format(self.image_name))
+        if self._cancelled:
+            raise RegistryHTTPException('Request for tags of image "{}" was cancelled'
+                                        .format(self.image_name))
+        if self._exception:
+            raise self._exception
+        return self._tags
+
+    def _start(self):
+        with self._lock:
+            if self._cancelled:
+                return False
+            self._started = True
+            return True
+
+    def _set_result(self, tags, exception):
+        self._tags = tags
+        self._exception = exception
+        self._done.set()
+
+
+class AsyncRegistry(object):
+    """
+    Registry client with the same surface as Registry, but where get_image_tags
+    returns a TagRequest immediately instead of blocking
+    """
+
+    _STOP = object()
+
+    def __init__(self, username, password, base_url, concurrency=10, **registry_args):
+        """
+        Constructor
+
+        Args:
+            username: username to login to the registry with
+            password: password to login to the registry with
+            base_url: the base url for the registry (example: https://private-registry.domain.com)
+            concurrency: the max number of concurrent requests to the registry
+            registry_args: other keyword arguments passed on to Registry
+        """
+        self.concurrency = concurrency
+        self.registry = Registry(username, password, base_url, pool_size=concurrency,
+                                 **registry_args)
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+
+    def get_image_tags(self, image_name):
+        """
+        Queues a request for the tags of the given image name
+
+        Args:
+            image_name: the name of the image
+
+        Returns:
+            TagRequest: call result() on it to get the tags
+        """
+        self._start_workers()
+        request = TagRequest(image_name)
+        self._queue.put(request)
+        return request
+
+    def close(self):
+        """
+        Stops the worker threads, after all queued requests are handled, and
+        closes all pooled connections to the registry
+        """
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._queue.put(AsyncRegistry._STOP)
+        for worker in workers:
+            worker.join()
+        self.registry.close()
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._workers) < self.concurrency:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            request = self._queue.get()
+            if request is AsyncRegistry._STOP:
+                return
+            if not request._start():
+                continue
+            try:
+                request._set_result(self.registry.get_image_tags(request.image_name), None)
+            except Exception as ex: # pylint: disable=W0703
+                self.log.debug('Getting tags for image "%s" failed: %s', request.image_name, ex)
+                request._set_result(None, ex)
@@ -3,10 +3,21 @@ Module to handle docker registry requests
 """
 __author__ = 'tinglev@kth.se'
 
+import time
+import fnmatch
 import logging
-import requests
-from requests import ConnectionError, HTTPError, Timeout
+import threading
+import Queue
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from requests import ConnectionError, HTTPError, RequestException, Timeout
+from requests.adapters import HTTPAdapter
+from requests.compat import urljoin, urlencode
 from everest_util.base_exception import EverestException
+from everest_util.single_flight import SingleFlight, SingleFlightTimeoutException
+from everest_util.flow_control import LatencyTracker
+from everest_util.systems.registry_auth import BearerTokenCache
+from everest_util.systems.session_pool import SessionPool
 
 class RegistryImageException(EverestException):
     """
@@ -15,6 +26,12 @@ class RegistryImageException(EverestException):
     """
     pass
 
+class RegistryImageNotFoundException(RegistryImageException):
+    """
+    Exception raised when the registry has nothing for a specific image (404)
+    """
+    pass
+
 class RegistryHTTPException(EverestException):
     """
     Exception raised when an http error of some sort occurs during connection
@@ -22,12 +39,21 @@ class RegistryHTTPException(EverestException):
     """
     pass
 
+class RegistryCacheException(EverestException):
+    """
+    Exception raised when a cache operation is requested on a registry
+    without a tag cache
+    """
+    pass
+
 class Registry(object):
     """
     The registry class
     """
 
-    def __init__(self, username, password, base_url):
+    def __init__(self, username, password, base_url, pool_size=10, timeout=30,
+                 tag_cache=None, limiter=None, hedge_percentile=None, max_retries=0,
+                 transport=None):
         """
         Constructor
 
@@ -35,20 +61,52 @@ class Registry(object):
             username: username to login to the registry with
             password: password to login to the registry with
             base_url: the base url for the registry (example: https://private-registry.domain.com)
+            pool_size: the max number of keep-alive connections kept open to the registry
+            timeout: timeout in seconds for each request, or a (connect, read) tuple.
+                     None waits forever.
+            tag_cache: a TagCache to serve tag lists from (see registry_cache.py), or
+                       None to always ask the registry
+            limiter: an AdaptiveLimiter (see flow_control.py) limiting the number of
+                     concurrent requests, or None for no limit
+            hedge_percentile: if set (for instance 95), a second identical request is
+                              sent when a request takes longer than this percentile
+                              of recent request latencies, and the first response wins
+            max_retries: the number of times to retry a request answered with 429 or
+                         503, after waiting for its Retry-After
+            transport: the requests transport adapter to send requests through (for
+                       instance a RecordingAdapter or ReplayAdapter, see
+                       registry_replay.py), None sends them over a pooled HTTPAdapter
         """
         self.username = username
         self.password = password
         self.base_url = base_url
+        self.timeout = timeout
+        self.tag_cache = tag_cache
+        self.limiter = limiter
+        self.hedge_percentile = hedge_percentile
+        self.max_retries = max_retries
+        self._latencies = LatencyTracker()
+        self._sessions = SessionPool(transport or HTTPAdapter(pool_maxsize=pool_size))
+        self._tokens = BearerTokenCache()
+        self._in_flight = SingleFlight()
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        # Hedged requests run on long lived threads, so that their per thread
+        # sessions are reused
+        self._hedge_pool = ThreadPool(2 * pool_size) if hedge_percentile else None
         self.log = logging.getLogger(__name__)
         # Suppress "Starting new HTTPS connection (1)" logging from requests.
         logging.getLogger("requests").setLevel(logging.WARNING)
 
-    def get_image_tags(self, image_name):
+    def get_image_tags(self, image_name, deadline=None):
         """
-        Gets the tags for the given image name from the registry
+        Gets the tags for the given image name from the registry. Concurrent
+        calls for the same image share one request to the registry.
 
         Args:
             image_name: the name of the image
+            deadline: the max number of seconds the call may take in total,
+                      None only limits each request by the timeout
 
         Returns:
             json array: an array with all tags for the given image
@@ -56,10 +114,294 @@ class Registry(object):
         Raises:
             RegistryImageException: on no tags found or parse error of tags
         """
+        deadline_at = time.time() + deadline if deadline is not None else None
+        try:
+            # A caller joining a call in flight waits with its own deadline
+            return self._in_flight.do_within(image_name, deadline, self._get_image_tags,
+                                             image_name, deadline_at)
+        except SingleFlightTimeoutException as timeout_ex:
+            raise RegistryHTTPException('Deadline passed while waiting for tags of {}'
+                                        .format(image_name), ex=timeout_ex)
+
+    def get_registry(self, host):
+        """
+        Gets the registry to use for images from the given registry host. A single
+        Registry serves all hosts, use RegistryRouter to route hosts to different
+        registries.
+
+        Args:
+            host: the registry host of an image, or None
+
+        Returns:
+            Registry: this registry
+        """
+        return self
+
+    def get_image_tags_many(self, image_names, max_workers=8, deadline=None):
+        """
+        Gets the tags for several images concurrently, on a bounded pool of threads.
+        Duplicate image names are only fetched once.
+
+        Args:
+            image_names: an array of image names
+            max_workers: the max number of concurrent requests to the registry
+            deadline: the max number of seconds each image may take, see get_image_tags()
+
+        Returns:
+            dict: image name -> an array with all tags for the image, or the
+                  RegistryImageException/RegistryHTTPException raised for the image
+        """
+        unique_names = list(OrderedDict.fromkeys(image_names))
+        if not unique_names:
+            return {}
+        self.log.debug('Getting tags for %i images', len(unique_names))
+        pool = ThreadPool(min(max_workers, len(unique_names)))
+        try:
+            results = pool.map(lambda name: self._get_image_tags_or_exception(name, deadline),
+                               unique_names)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(unique_names, results))
+
+    def iter_image_tags(self, image_name, page_size=100):
+        """
+        Gets the tags for the given image name page by page, using the n/last
+        pagination and Link header of the registry v2 api. Tags are yielded as
+        soon as their page arrives, so the full list is never held in memory.
+        Tags are never served from, or added to, the tag cache.
+
+        Args:
+            image_name: the name of the image
+            page_size: the number of tags to request per page
+
+        Yields:
+            string: the tags for the given image
+
+        Raises:
+            RegistryImageException: on no tags found or parse error of tags
+        """
+        self.log.debug('Iterating tags for image "%s"', image_name)
+        for _, tags in self._iter_tag_pages(image_name, page_size):
+            for tag in tags or []:
+                yield tag
+
+    def iter_repositories(self, page_size=100):
+        """
+        Gets the names of all repositories in the registry page by page, from
+        the /v2/_catalog endpoint
+
+        Args:
+            page_size: the number of repositories to request per page
+
+        Yields:
+            string: the repository (image) names
+
+        Raises:
+            RegistryHTTPException: on http errors
+            RegistryImageException: on parse error of the catalog
+        """
+        url = self._get_catalog_url(page_size)
+        last = None
+        while url:
+            response = self._registry_request(url, scope='registry:catalog:*')
+            try:
+                repositories = response.json()['repositories'] or []
+            except (KeyError, TypeError, ValueError) as catalog_err:
+                raise RegistryImageException('Could not parse catalog from registry',
+                                             catalog_err)
+            if Registry._is_repeated_page(repositories, last):
+                return
+            for repository in repositories:
+                yield repository
+            url = self._get_next_page_url(response, page_size, repositories,
+                                          lambda last: self._get_catalog_url(page_size, last))
+            last = repositories[-1] if repositories else None
+
+    def warm_cache(self, repository_filter=None, max_workers=8, progress_callback=None):
+        """
+        Fills the tag cache with the tags of all repositories in the registry
+        catalog (or the ones matching the filter), on a bounded pool of threads
+
+        Args:
+            repository_filter: a glob pattern (for instance 'kth-*') or a function
+                               taking a repository name and returning a bool,
+                               None warms all repositories
+            max_workers: the max number of concurrent requests to the registry
+            progress_callback: an optional function called with (done, total)
+                               after each repository
+
+        Returns:
+            dict: number of repositories, number of failed repositories and the
+                  time it took in seconds
+
+        Raises:
+            RegistryCacheException: if the registry has no tag cache
+            RegistryHTTPException: if the catalog could not be fetched
+        """
+        if self.tag_cache is None:
+            raise RegistryCacheException('Cannot warm the cache of a registry without tag cache')
+        started = time.time()
+        if repository_filter and not callable(repository_filter):
+            pattern = repository_filter
+            repository_filter = lambda repository: fnmatch.fnmatchcase(repository, pattern)
+        repositories = [repository for repository in self.iter_repositories()
+                        if not repository_filter or repository_filter(repository)]
+        self.log.info('Warming tag cache for %i repositories', len(repositories))
+        failed = 0
+        if repositories:
+            pool = ThreadPool(min(max_workers, len(repositories)))
+            try:
+                results = pool.imap_unordered(
+                    lambda name: (name, self._get_image_tags_or_exception(name, None)),
+                    repositories)
+                for done, (name, result) in enumerate(results, 1):
+                    if isinstance(result, Exception):
+                        failed += 1
+                        self.log.debug('Could not warm tags for "%s": %s', name, result)
+                    if progress_callback:
+                        progress_callback(done, len(repositories))
+            finally:
+                pool.close()
+                pool.join()
+        seconds = time.time() - started
+        self.log.info('Warmed tag cache for %i repositories (%i failed) in %.2f seconds',
+                      len(repositories), failed, seconds)
+        return dict(repositories=len(repositories), failed=failed, seconds=seconds)
+
+    def close(self):
+        """
+        Closes all pooled connections to the registry
+        """
+        if self._hedge_pool:
+            self._hedge_pool.close()
+        self._sessions.close()
+
+    def _get_image_tags(self, image_name, deadline_at):
         self.log.debug('Getting tags for image "%s"', image_name)
-        url = self._get_tags_url(image_name)
-        response = self._registry_request(url)
-        return self._get_tags_list_from_response(response)
+        if self.tag_cache is None:
+            return self._fetch_image_tags(image_name, deadline_at=deadline_at)[0]
+        missing = self.tag_cache.get_missing(image_name)
+        if missing:
+            raise missing
+        entry = self.tag_cache.get(image_name)
+        if entry and self.tag_cache.is_fresh(entry):
+            self.tag_cache.count_hit()
+            return entry.tags
+        if entry and self.tag_cache.is_servable_stale(entry):
+            self.tag_cache.count_stale_hit()
+            self._refresh_in_background(image_name, entry)
+            return entry.tags
+        return self._update_cache(image_name, entry, deadline_at)
+
+    def _update_cache(self, image_name, entry, deadline_at=None):
+        """
+        Fetches the tags for an image, revalidating the cached entry if there is one,
+        and updates the tag cache
+
+        Returns:
+            json array: an array with all tags for the given image
+        """
+        try:
+            tags, etag = self._fetch_image_tags(image_name, entry.etag if entry else None,
+                                                deadline_at)
+        except RegistryImageNotFoundException as not_found:
+            self.tag_cache.set_missing(image_name, not_found)
+            raise
+        if tags is None:
+            self.log.debug('Tags for image "%s" are unchanged', image_name)
+            self.tag_cache.count_revalidation()
+            self.tag_cache.refresh(image_name, entry)
+            return entry.tags
+        self.tag_cache.count_miss()
+        self.tag_cache.set(image_name, tags, etag)
+        return tags
+
+    def _refresh_in_background(self, image_name, entry):
+        with self._refreshing_lock:
+            if image_name in self._refreshing:
+                return
+            self._refreshing.add(image_name)
+        def refresh():
+            try:
+                self._update_cache(image_name, entry)
+            except EverestException as ex:
+                self.log.warning('Background refresh of tags for image "%s" failed: %s',
+                                 image_name, ex)
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(image_name)
+        self.log.debug('Serving stale tags for image "%s" while refreshing', image_name)
+        Registry._start_thread(refresh)
+
+    def _get_image_tags_or_exception(self, image_name, deadline):
+        try:
+            return self.get_image_tags(image_name, deadline)
+        except EverestException as ex:
+            return ex
+
+    def _fetch_image_tags(self, image_name, etag=None, deadline_at=None):
+        """
+        Returns:
+            tuple: (tags, etag), where tags is None if the registry answered
+                   304 Not Modified to the given etag
+        """
+        headers = {'If-None-Match': etag} if etag else None
+        pages = self._iter_tag_pages(image_name, headers=headers, deadline_at=deadline_at)
+        response, tags = next(pages)
+        if response.status_code == 304:
+            return None, etag
+        etag = response.headers.get('ETag')
+        tags = list(tags or [])
+        for _, page_tags in pages:
+            # The etag only covers the first page
+            etag = None
+            tags.extend(page_tags or [])
+        return tags, etag
+
+    def _iter_tag_pages(self, image_name, page_size=None, headers=None, deadline_at=None):
+        """
+        Yields:
+            tuple: (response, tags) for each page of tags, where tags is None if the
+                   registry answered 304 Not Modified
+        """
+        url = self._get_tags_url(image_name, page_size)
+        scope = 'repository:{}:pull'.format(image_name)
+        last = None
+        while url:
+            response = self._registry_request(url, headers, scope, deadline_at)
+            if response.status_code == 304:
+                yield response, None
+                return
+            tags = self._get_tags_list_from_response(response)
+            if Registry._is_repeated_page(tags, last):
+                return
+            yield response, tags
+            url = self._get_next_page_url(response, page_size, tags,
+                                          lambda last: self._get_tags_url(image_name,
+                                                                          page_size, last))
+            last = tags[-1] if tags else None
+            headers = None
+
+    def _get_next_page_url(self, response, page_size, items, get_url):
+        next_link = response.links.get('next')
+        if next_link:
+            return urljoin(self.base_url, next_link['url'])
+        if page_size and items and len(items) == page_size:
+            # Registries that don't send a Link header may still support n/last.
+            # A page larger than asked for means that the registry ignores n and
+            # we are done (see _is_repeated_page() for a registry ignoring last).
+            return get_url(items[-1])
+        return None
+
+    @staticmethod
+    def _is_repeated_page(items, previous_last):
+        """
+        Returns:
+            bool: True if a page ends where the previous page ended, which means
+                  that the registry ignores last and sent the same page again
+        """
+        return bool(previous_last is not None and items and items[-1] == previous_last)
 
     def _get_tags_list_from_response(self, response):
         try:
@@ -69,16 +411,44 @@ class Registry(object):
         except ValueError as json_err:
             raise RegistryImageException('Could not parse json response from registry', json_err)
 
-    def _get_tags_url(self, image_name):
-        tags_url = "{}/v2/{}/tags/list".format(self.base_url, image_name)
+    def _get_tags_url(self, image_name, page_size=None, last=None):
+        tags_url = Registry._add_page_query("{}/v2/{}/tags/list".format(self.base_url,
+                                                                        image_name),
+                                            page_size, last)
         self.log.debug('Getting tags from url %s', tags_url)
         return tags_url
 
-    def _registry_request(self, url):
+    def _get_catalog_url(self, page_size=None, last=None):
+        return Registry._add_page_query('{}/v2/_catalog'.format(self.base_url), page_size, last)
+
+    @staticmethod
+    def _add_page_query(url, page_size, last):
+        if not page_size:
+            return url
+        query = [('n', page_size)]
+        if last:
+            query.append(('last', last))
+        return '{}?{}'.format(url, urlencode(query))
+
+    def _registry_request(self, url, headers=None, scope=None, deadline_at=None):
         try:
-            response = requests.get(url, auth=(self.username, self.password))
-            response.raise_for_status()
-            return response
+            retries = 0
+            while True:
+                response = self._limited_request(url, headers, scope, deadline_at)
+                if response.status_code == 401:
+                    challenge = BearerTokenCache.parse_challenge(
+                        response.headers.get('WWW-Authenticate'))
+                    if challenge:
+                        request_scope = scope
+                        scope = challenge.get('scope', scope)
+                        self._fetch_token(challenge, scope, request_scope)
+                        response = self._limited_request(url, headers, scope, deadline_at)
+                if (response.status_code in (429, 503) and retries < self.max_retries and
+                        self._wait_before_retry(response, deadline_at)):
+                    retries += 1
+                    continue
+                response.raise_for_status()
+                return response
         except Timeout as timeout_ex:
             raise RegistryHTTPException('Request to Docker registry timed out', ex=timeout_ex)
         except ConnectionError as conn_ex:
@@ -86,11 +456,174 @@ class Registry(object):
         except HTTPError as http_ex:
             self._handle_http_error(http_ex, url)
 
+    def _limited_request(self, url, headers, scope, deadline_at):
+        """
+        Sends a (possibly hedged) request within the concurrency limit and the deadline
+        """
+        if self.limiter and not self.limiter.acquire(self._get_time_left(deadline_at)):
+            raise RegistryHTTPException('Deadline passed while waiting to call the '
+                                        'Docker registry for {}'.format(url))
+        response = None
+        try:
+            # After acquire, so that the time waiting for the limiter is subtracted
+            timeout = self._get_request_timeout(deadline_at)
+            response = self._hedged_request(url, headers, scope, timeout)
+            return response
+        finally:
+            if self.limiter:
+                self._release_limiter(response)
+
+    def _hedged_request(self, url, headers, scope, timeout):
+        """
+        Sends a request, and a second identical one if the first is slower than
+        the hedge percentile of recent latencies. The first response wins. The
+        second request takes its own limiter slot, and is skipped if there is none.
+        """
+        hedge_after = None
+        if self.hedge_percentile:
+            hedge_after = self._latencies.get_percentile(self.hedge_percentile)
+        if hedge_after is None:
+            return self._send_request(url, headers, scope, timeout)
+        results = Queue.Queue()
+        def attempt(holds_slot):
+            response = None
+            try:
+                response = self._send_request(url, headers, scope, timeout)
+                results.put((response, None))
+            except Exception as ex: # pylint: disable=W0703
+                results.put((None, ex))
+            finally:
+                if holds_slot:
+                    self._release_limiter(response)
+        attempts = 1
+        self._hedge_pool.apply_async(attempt, (False,))
+        try:
+            response, error = results.get(timeout=hedge_after)
+        except Queue.Empty:
+            if self.limiter and not self.limiter.acquire(0):
+                self.log.debug('Not hedging request to %s, concurrency limit reached', url)
+            else:
+                self.log.debug('Hedging request to %s after %.3f seconds', url, hedge_after)
+                attempts = 2
+                self._hedge_pool.apply_async(attempt, (self.limiter is not None,))
+            response, error = results.get()
+        if error and attempts == 2:
+            response, error = results.get()
+        if error:
+            raise error
+        return response
+
+    def _send_request(self, url, headers, scope, timeout):
+        """
+        Sends a request with a cached bearer token for the scope, if there is
+        one, and otherwise with basic auth
+        """
+        headers = dict(headers or {})
+        token = self._tokens.get(scope) if scope else None
+        auth = None
+        if token:
+            headers['Authorization'] = 'Bearer {}'.format(token)
+        else:
+            auth = (self.username, self.password)
+        started = time.time()
+        response = self._sessions.get().get(url, headers=headers, auth=auth, timeout=timeout)
+        self._latencies.add(time.time() - started)
+        return response
+
+    def _wait_before_retry(self, response, deadline_at):
+        """
+        Sleeps for the Retry-After of the response (or one second)
+
+        Returns:
+            bool: False, without sleeping, if the deadline would pass before the retry
+        """
+        wait = Registry._get_retry_after(response) or 1
+        time_left = self._get_time_left(deadline_at)
+        if time_left is not None and wait >= time_left:
+            return False
+        self.log.debug('Docker registry returned %s, retrying in %s seconds',
+                       response.status_code, wait)
+        time.sleep(wait)
+        return True
+
+    def _get_time_left(self, deadline_at):
+        if deadline_at is None:
+            return None
+        time_left = deadline_at - time.time()
+        if time_left <= 0:
+            raise RegistryHTTPException('Deadline for Docker registry request passed')
+        return time_left
+
+    def _get_request_timeout(self, deadline_at):
+        time_left = self._get_time_left(deadline_at)
+        if time_left is None:
+            return self.timeout
+        if self.timeout is None:
+            return time_left
+        if isinstance(self.timeout, tuple):
+            return tuple(min(part, time_left) for part in self.timeout)
+        return min(self.timeout, time_left)
+
+    def _release_limiter(self, response):
+        overloaded = response is None or response.status_code in (429, 503)
+        self.limiter.release(overloaded, Registry._get_retry_after(response))
+
+    @staticmethod
+    def _get_retry_after(response):
+        if response is None:
+            return None
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _start_thread(target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    def _fetch_token(self, challenge, scope, request_scope=None):
+        """
+        Gets a token from the token server given in a Bearer challenge, and caches
+        it for the scope. The token is also cached for the scope of the request
+        that was challenged, which the next request is looked up with, when the
+        registry asked for a different scope.
+
+        Raises:
+            RegistryHTTPException: if no token could be fetched
+        """
+        realm = challenge.get('realm')
+        if not realm:
+            raise RegistryHTTPException('Docker registry sent a Bearer challenge without realm')
+        params = dict((key, challenge[key]) for key in ('service', 'scope') if key in challenge)
+        if scope:
+            params['scope'] = scope
+        self.log.debug('Getting token for scope "%s" from %s', scope, realm)
+        auth = (self.username, self.password) if self.username else None
+        try:
+            response = self._sessions.get().get(realm, params=params, auth=auth,
+                                               timeout=self.timeout)
+            response.raise_for_status()
+        except RequestException as request_err:
+            # Raised here, so that it isn't mistaken for an error from the registry
+            raise RegistryHTTPException('Could not get token from {}'.format(realm),
+                                        ex=request_err)
+        try:
+            token_json = response.json()
+            token = token_json.get('token') or token_json['access_token']
+        except (KeyError, ValueError, AttributeError) as token_err:
+            raise RegistryHTTPException('Could not parse token from {}'.format(realm),
+                                        ex=token_err)
+        self._tokens.set(scope, token, token_json.get('expires_in'))
+        if request_scope and request_scope != scope:
+            self._tokens.set(request_scope, token, token_json.get('expires_in'))
+
     def _handle_http_error(self, error, url):
         code = error.response.status_code
         if code == 404:
-            raise RegistryImageException('Nothing found in Docker registry for {}'
-                                         .format(url), ex=error)
+            raise RegistryImageNotFoundException('Nothing found in Docker registry for {}'
+                                                 .format(url), ex=error)
         else:
             raise RegistryHTTPException('Docker registry returned status code {} for {}'
                                         .format(code, url), ex=error)
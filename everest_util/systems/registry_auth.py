@@ -0,0 +1,82 @@
+"""
+Module for docker registry token (Bearer) authentication
+
+For more information on the token flow see:
+https://docs.docker.com/registry/spec/auth/token/
+"""
+__author__ = 'tinglev@kth.se'
+
+import re
+import time
+import threading
+
+class BearerTokenCache(object):
+    """
+    Thread safe cache of registry tokens, per scope (for instance
+    repository:kth-azure-app:pull), kept until they expire
+    """
+
+    # Tokens are dropped this many seconds before they expire, so that they
+    # don't expire on the way to the registry
+    EXPIRY_MARGIN = 5
+    # Lifetime of tokens that are returned without expires_in (from the spec)
+    DEFAULT_EXPIRES_IN = 60
+
+    _CHALLENGE_PARAM_REGEX = r'(\w+)="([^"]*)"'
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get(self, scope):
+        """
+        Gets the cached token for a scope
+
+        Args:
+            scope: the scope of the token
+
+        Returns:
+            string: the token, or None if there is no valid token for the scope
+        """
+        with self._lock:
+            cached = self._tokens.get(scope)
+            if cached and cached[1] > time.time():
+                return cached[0]
+            self._tokens.pop(scope, None)
+            return None
+
+    def set(self, scope, token, expires_in=None):
+        """
+        Caches a token for a scope
+
+        Args:
+            scope: the scope of the token
+            token: the token
+            expires_in: the lifetime of the token in seconds, as returned by the
+                        token server
+        """
+        if not expires_in:
+            expires_in = BearerTokenCache.DEFAULT_EXPIRES_IN
+        expires_at = time.time() + expires_in - BearerTokenCache.EXPIRY_MARGIN
+        with self._lock:
+            self._tokens[scope] = (token, expires_at)
+
+    @staticmethod
+    def parse_challenge(header):
+        """
+        Parses a WWW-Authenticate header
+
+        Args:
+            header: the value of the header (for instance
+                    'Bearer realm="https://auth.docker.io/token",service="registry.docker.io"')
+
+        Returns:
+            dict: the challenge parameters (realm, service, scope), or None if the
+                  header is not a Bearer challenge
+        """
+        if not header or not header.lower().startswith('bearer '):
+            return None
+        return dict(re.findall(BearerTokenCache._CHALLENGE_PARAM_REGEX, header))
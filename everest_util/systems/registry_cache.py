@@ -0,0 +1,350 @@
+"""
+Module for caching docker registry responses
+"""
+__author__ = 'tinglev@kth.se'
+
+import os
+import json
+import errno
+import time
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class TagCacheEntry(object):
+    """
+    A cached tag list for one image
+    """
+
+    def __init__(self, tags, etag, fetched_at):
+        """
+        Constructor
+
+        Args:
+            tags: the list of tags for the image
+            etag: the ETag header returned with the tag list, or None
+            fetched_at: the time.time() when the tag list was last fetched or revalidated
+        """
+        self.tags = tags
+        self.etag = etag
+        self.fetched_at = fetched_at
+
+    def get_age(self):
+        """
+        Returns:
+            float: the number of seconds since the entry was fetched or revalidated
+        """
+        return time.time() - self.fetched_at
+
+
+class TagCache(object):
+    """
+    Thread safe, size bounded (least recently used) cache of image tag lists.
+    Entries older than the ttl are kept, so that they can be revalidated
+    against the registry with their ETag. Images missing in the registry can
+    also be cached, for negative_ttl seconds.
+    """
+
+    def __init__(self, ttl=60, max_size=1000, disk_cache=None, negative_ttl=0,
+                 stale_while_revalidate=0):
+        """
+        Constructor
+
+        Args:
+            ttl: the number of seconds a tag list is served without asking the registry
+            max_size: the max number of images to keep in the cache
+            disk_cache: an optional DiskTagCache that entries are written through to,
+                        and read from when they are missing in memory
+            negative_ttl: the number of seconds an image that the registry has nothing
+                          for (404) is remembered as missing
+            stale_while_revalidate: the number of seconds after the ttl that an entry
+                                    is still served, while it is refreshed in the
+                                    background
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.disk_cache = disk_cache
+        self.negative_ttl = negative_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.hits = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._missing = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Returns:
+            int: the number of cached images
+        """
+        return len(self._entries)
+
+    def get(self, image_name):
+        """
+        Gets the cached entry for an image, fresh or not
+
+        Args:
+            image_name: the name of the image
+
+        Returns:
+            TagCacheEntry: the entry, or None if the image is not cached
+        """
+        with self._lock:
+            entry = self._entries.pop(image_name, None)
+            if entry:
+                self._entries[image_name] = entry
+                return entry
+        if self.disk_cache:
+            entry = self.disk_cache.get(image_name)
+            if entry:
+                self._add(image_name, entry)
+        return entry
+
+    def is_fresh(self, entry):
+        """
+        Args:
+            entry: a TagCacheEntry
+
+        Returns:
+            bool: True if the entry can be served without asking the registry
+        """
+        return entry.get_age() < self.ttl
+
+    def is_servable_stale(self, entry):
+        """
+        Args:
+            entry: a TagCacheEntry
+
+        Returns:
+            bool: True if the entry is not fresh, but may still be served while it
+                  is refreshed in the background
+        """
+        return entry.get_age() < self.ttl + self.stale_while_revalidate
+
+    def get_missing(self, image_name):
+        """
+        Gets the cached exception for an image that the registry had nothing for,
+        if it was cached less than negative_ttl seconds ago
+
+        Args:
+            image_name: the name of the image
+
+        Returns:
+            RegistryImageException: the exception to raise again, or None
+        """
+        with self._lock:
+            missing = self._missing.get(image_name)
+            if not missing:
+                return None
+            if time.time() - missing[1] >= self.negative_ttl:
+                del self._missing[image_name]
+                return None
+            self.negative_hits += 1
+            return missing[0]
+
+    def set_missing(self, image_name, exception):
+        """
+        Remembers that the registry had nothing for an image (does nothing if
+        negative_ttl is 0)
+
+        Args:
+            image_name: the name of the image
+            exception: the exception raised when asking the registry for the image
+        """
+        if not self.negative_ttl:
+            return
+        with self._lock:
+            self._missing.pop(image_name, None)
+            self._missing[image_name] = (exception, time.time())
+            while len(self._missing) > self.max_size:
+                self._missing.popitem(last=False)
+
+    def set(self, image_name, tags, etag=None):
+        """
+        Adds or replaces the entry for an image, evicting the least recently used
+        entry when the cache is full
+
+        Args:
+            image_name: the name of the image
+            tags: the list of tags for the image
+            etag: the ETag header returned with the tag list, or None
+
+        Returns:
+            TagCacheEntry: the new entry
+        """
+        entry = TagCacheEntry(tags, etag, time.time())
+        self._add(image_name, entry)
+        if self.disk_cache:
+            self.disk_cache.set(image_name, entry)
+        return entry
+
+    def refresh(self, image_name, entry):
+        """
+        Marks an entry as fresh again, after the registry confirmed that it is unchanged
+
+        Args:
+            image_name: the name of the image
+            entry: the TagCacheEntry to refresh
+        """
+        entry.fetched_at = time.time()
+        if self.disk_cache:
+            self.disk_cache.set(image_name, entry)
+
+    def clear(self):
+        """
+        Removes all entries from the cache, including the disk cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self._missing.clear()
+        if self.disk_cache:
+            self.disk_cache.clear()
+
+    def _add(self, image_name, entry):
+        with self._lock:
+            self._missing.pop(image_name, None)
+            self._entries.pop(image_name, None)
+            self._entries[image_name] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def count_hit(self):
+        """
+        Counts a tag list served from the cache
+        """
+        with self._lock:
+            self.hits += 1
+
+    def count_stale_hit(self):
+        """
+        Counts a stale tag list served while it is refreshed in the background
+        """
+        with self._lock:
+            self.stale_hits += 1
+
+    def count_miss(self):
+        """
+        Counts a tag list that had to be downloaded from the registry
+        """
+        with self._lock:
+            self.misses += 1
+
+    def count_revalidation(self):
+        """
+        Counts a tag list that the registry confirmed as unchanged (304)
+        """
+        with self._lock:
+            self.revalidations += 1
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: the hit, stale hit, negative hit, miss and revalidation counters
+                  and the size of the cache
+        """
+        with self._lock:
+            return dict(hits=self.hits, stale_hits=self.stale_hits,
+                        negative_hits=self.negative_hits, misses=self.misses,
+                        revalidations=self.revalidations, size=len(self._entries))
+
+
+class DiskTagCache(object):
+    """
+    Persistent store of tag lists in an sqlite database, so that a restarted
+    process can warm up its TagCache from disk and only has to revalidate the
+    entries. Several processes (and threads) can share the same directory.
+    Errors while reading or writing the database are logged and treated as
+    cache misses.
+    """
+
+    FILE_NAME = 'registry_tag_cache.sqlite'
+
+    def __init__(self, directory, namespace='', timeout=30):
+        """
+        Constructor
+
+        Args:
+            directory: the directory to keep the database in, created if missing
+            namespace: separates the entries of different registries sharing the
+                       same directory, for instance the base url of the registry
+            timeout: seconds to wait for a lock held by another process
+        """
+        self.directory = directory
+        self.namespace = namespace
+        self.timeout = timeout
+        self.path = os.path.join(directory, DiskTagCache.FILE_NAME)
+        self._local = threading.local()
+        self.log = logging.getLogger(__name__)
+        try:
+            os.makedirs(directory)
+        except OSError as os_err:
+            # Another process may have created the directory at the same time
+            if os_err.errno != errno.EEXIST or not os.path.isdir(directory):
+                raise
+        with self._get_connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS tags ('
+                               'namespace TEXT NOT NULL, image_name TEXT NOT NULL, '
+                               'tags TEXT NOT NULL, etag TEXT, fetched_at REAL NOT NULL, '
+                               'PRIMARY KEY (namespace, image_name))')
+
+    def get(self, image_name):
+        """
+        Gets the stored entry for an image
+
+        Args:
+            image_name: the name of the image
+
+        Returns:
+            TagCacheEntry: the entry, with the time it was fetched, or None if missing
+        """
+        try:
+            row = self._get_connection().execute(
+                'SELECT tags, etag, fetched_at FROM tags WHERE namespace = ? AND image_name = ?',
+                (self.namespace, image_name)).fetchone()
+        except sqlite3.Error as sql_err:
+            self.log.warning('Could not read tags for "%s" from %s: %s',
+                             image_name, self.path, sql_err)
+            return None
+        if not row:
+            return None
+        return TagCacheEntry(json.loads(row[0]), row[1], row[2])
+
+    def set(self, image_name, entry):
+        """
+        Stores the entry for an image, replacing any previous entry
+
+        Args:
+            image_name: the name of the image
+            entry: the TagCacheEntry to store
+        """
+        try:
+            with self._get_connection() as connection:
+                connection.execute('INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?)',
+                                   (self.namespace, image_name, json.dumps(entry.tags),
+                                    entry.etag, entry.fetched_at))
+        except sqlite3.Error as sql_err:
+            self.log.warning('Could not write tags for "%s" to %s: %s',
+                             image_name, self.path, sql_err)
+
+    def clear(self):
+        """
+        Removes all entries in this namespace
+        """
+        try:
+            with self._get_connection() as connection:
+                connection.execute('DELETE FROM tags WHERE namespace = ?', (self.namespace,))
+        except sqlite3.Error as sql_err:
+            self.log.warning('Could not clear tags in %s: %s', self.path, sql_err)
+
+    def _get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            # Write ahead logging lets readers in other processes work during writes
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
@@ -0,0 +1,261 @@
+"""
+Module to record docker registry responses to a file and replay them later,
+for deterministic offline profiling of tag parsing and version resolution
+
+Recording:
+    adapter = RecordingAdapter()
+    registry = Registry(username, password, base_url, transport=adapter)
+    ... (make the calls to profile)
+    adapter.recording.save('/tmp/registry.jsonl.gz')
+
+Replaying:
+    recording = ResponseRecording.load('/tmp/registry.jsonl.gz')
+    registry = Registry('', '', base_url, transport=ReplayAdapter(recording, latency='recorded'))
+"""
+__author__ = 'tinglev@kth.se'
+
+import gzip
+import json
+import time
+import logging
+import httplib
+import threading
+from datetime import timedelta
+from requests import ConnectionError, Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from everest_util.base_exception import EverestException
+
+class RegistryReplayException(EverestException):
+    """
+    Exception raised when a recording can't be read or written
+    """
+    pass
+
+class ResponseRecording(object):
+    """
+    Thread safe list of recorded responses. Saved as gzipped json, one
+    response per line. Credentials (tokens in token server responses and
+    cookies) are redacted when a response is recorded.
+    """
+
+    REDACTED = 'REDACTED'
+    SECRET_FIELDS = ('token', 'access_token', 'refresh_token')
+    SECRET_HEADERS = ('set-cookie',)
+
+    def __init__(self, records=None):
+        """
+        Constructor
+
+        Args:
+            records: an array of recorded responses (see create_record())
+        """
+        self._records = list(records or [])
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def create_record(request, response, elapsed):
+        """
+        Creates a record of a response. The body is stored as utf-8 text, which
+        holds for the json returned by docker registries. Secrets are replaced
+        with REDACTED, which still replays as a (useless) token.
+
+        Args:
+            request: the requests.PreparedRequest that was sent
+            response: the requests.Response that was returned
+            elapsed: the number of seconds the response took
+
+        Returns:
+            dict: the record
+        """
+        return {
+            'method': request.method,
+            'url': request.url,
+            'etag': request.headers.get('If-None-Match'),
+            'status': response.status_code,
+            'headers': dict((name, value) for name, value in response.headers.items()
+                            if name.lower() not in ResponseRecording.SECRET_HEADERS),
+            'body': ResponseRecording._redact(response.content.decode('utf-8', 'replace')),
+            'elapsed': round(elapsed, 6)
+        }
+
+    @staticmethod
+    def _redact(body):
+        try:
+            body_json = json.loads(body)
+        except ValueError:
+            return body
+        if not isinstance(body_json, dict):
+            return body
+        secrets = [field for field in ResponseRecording.SECRET_FIELDS if field in body_json]
+        if not secrets:
+            return body
+        for field in secrets:
+            body_json[field] = ResponseRecording.REDACTED
+        return json.dumps(body_json, separators=(',', ':'))
+
+    @staticmethod
+    def get_record_key(method, url, etag):
+        """
+        Returns:
+            tuple: the key that a request is matched against records with
+        """
+        return (method, url, etag)
+
+    def add(self, record):
+        """
+        Adds a record to the recording
+        """
+        with self._lock:
+            self._records.append(record)
+
+    def get_records(self):
+        """
+        Returns:
+            array: a copy of all records, in the order they were recorded
+        """
+        with self._lock:
+            return list(self._records)
+
+    def save(self, path):
+        """
+        Writes the recording to a file
+
+        Args:
+            path: the path of the file to (over)write
+
+        Raises:
+            RegistryReplayException: if the file couldn't be written
+        """
+        try:
+            with gzip.open(path, 'wb') as recording_file:
+                for record in self.get_records():
+                    recording_file.write(json.dumps(record, separators=(',', ':')))
+                    recording_file.write('\n')
+        except (IOError, OSError) as io_err:
+            raise RegistryReplayException('Could not write recording to {}'.format(path),
+                                          ex=io_err)
+
+    @staticmethod
+    def load(path):
+        """
+        Reads a recording from a file written by save()
+
+        Args:
+            path: the path of the file
+
+        Returns:
+            ResponseRecording: the recording
+
+        Raises:
+            RegistryReplayException: if the file couldn't be read or parsed
+        """
+        try:
+            with gzip.open(path, 'rb') as recording_file:
+                return ResponseRecording([json.loads(line) for line in recording_file
+                                          if line.strip()])
+        except (IOError, OSError, ValueError) as io_err:
+            raise RegistryReplayException('Could not read recording from {}'.format(path),
+                                          ex=io_err)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    A requests transport adapter that sends requests like HTTPAdapter does, and
+    records every response with its timing
+    """
+
+    def __init__(self, recording=None, **adapter_args):
+        """
+        Constructor
+
+        Args:
+            recording: the ResponseRecording to add responses to, None creates a new one
+            adapter_args: arguments passed on to HTTPAdapter (for instance pool_maxsize)
+        """
+        super(RecordingAdapter, self).__init__(**adapter_args)
+        self.recording = recording if recording is not None else ResponseRecording()
+
+    def send(self, request, **kwargs): # pylint: disable=W0221
+        started = time.time()
+        response = super(RecordingAdapter, self).send(request, **kwargs)
+        # Reading the content here includes the body transfer in the timing,
+        # requests keeps the read content for the caller
+        content = response.content
+        self.recording.add(ResponseRecording.create_record(request, response,
+                                                           time.time() - started))
+        logging.getLogger(__name__).debug('Recorded %s %s (%s bytes)', request.method,
+                                          request.url, len(content))
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    A requests transport adapter that answers requests from a recording, without
+    any network. Requests are matched on method, url and If-None-Match header.
+    Repeated requests are answered with the responses recorded for them, in
+    order, after which the last response is repeated.
+    """
+
+    def __init__(self, recording, latency=None):
+        """
+        Constructor
+
+        Args:
+            recording: the ResponseRecording to replay
+            latency: None to answer immediately, 'recorded' to wait as long as
+                     the recorded response took, or a number of seconds to wait
+                     before each response
+        """
+        super(ReplayAdapter, self).__init__()
+        self.latency = latency
+        self.replayed = 0
+        self._records = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+        for record in recording.get_records():
+            key = ResponseRecording.get_record_key(record['method'], record['url'],
+                                                   record['etag'])
+            self._records.setdefault(key, []).append(record)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None,
+             proxies=None):
+        record = self._get_next_record(request)
+        if record is None:
+            raise ConnectionError('No recorded response for {} {}'
+                                  .format(request.method, request.url), request=request)
+        if self.latency == 'recorded':
+            time.sleep(record['elapsed'])
+        elif self.latency:
+            time.sleep(self.latency)
+        return self._build_response(request, record)
+
+    def close(self):
+        pass
+
+    def _get_next_record(self, request):
+        key = ResponseRecording.get_record_key(request.method, request.url,
+                                               request.headers.get('If-None-Match'))
+        with self._lock:
+            records = self._records.get(key)
+            if not records:
+                return None
+            position = self._positions.get(key, 0)
+            self._positions[key] = min(position + 1, len(records) - 1)
+            self.replayed += 1
+            return records[position]
+
+    def _build_response(self, request, record):
+        response = Response()
+        response.status_code = record['status']
+        response.reason = httplib.responses.get(record['status'], '')
+        response.headers = CaseInsensitiveDict(record['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = record['body'].encode('utf-8') # pylint: disable=W0212
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(seconds=record['elapsed'])
+        return response
@@ -0,0 +1,103 @@
+"""
+Module to route docker registry requests to the right registry, based on the
+registry host in the image reference
+"""
+__author__ = 'tinglev@kth.se'
+
+import logging
+import threading
+from everest_util.base_exception import EverestException
+
+class RegistryRouterException(EverestException):
+    """
+    Exception raised when there is no registry configured for a host
+    """
+    pass
+
+class RegistryRouter(object):
+    """
+    Keeps one Registry per registry host, each with its own connection pool,
+    credentials and tag cache. Can be used wherever a Registry is dependency
+    injected (for instance in Application and Service).
+    """
+
+    def __init__(self, default=None, registries=None, factory=None):
+        """
+        Constructor
+
+        Args:
+            default: the Registry used for images without a registry host in their
+                     reference, and for all other calls made directly on the router
+            registries: a dict of registry host -> Registry
+            factory: an optional function taking a registry host and returning a new
+                     Registry for it, used for hosts missing in registries. The
+                     created Registry is kept and reused.
+        """
+        self.default = default
+        self.factory = factory
+        self._registries = dict(registries or {})
+        self._lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+
+    def get_registry(self, host):
+        """
+        Gets the Registry for a registry host
+
+        Args:
+            host: the registry host of an image (for instance 'kthregistry.sys.kth.se'),
+                  or None for images without a registry host
+
+        Returns:
+            Registry: the registry to use for the host
+
+        Raises:
+            RegistryRouterException: if no registry is configured for the host
+        """
+        if host is None:
+            return self._get_default()
+        with self._lock:
+            registry = self._registries.get(host)
+            if registry is None and self.factory:
+                self.log.debug('Creating registry client for host "%s"', host)
+                registry = self._registries[host] = self.factory(host)
+        if registry is None:
+            raise RegistryRouterException('No registry configured for host "{}"'.format(host))
+        return registry
+
+    def get_hosts(self):
+        """
+        Returns:
+            array: the registry hosts that currently have a Registry
+        """
+        with self._lock:
+            return list(self._registries)
+
+    def get_image_tags(self, image_name, deadline=None):
+        """
+        Gets the tags for the given image name from the default registry,
+        see Registry.get_image_tags()
+        """
+        return self._get_default().get_image_tags(image_name, deadline)
+
+    def get_image_tags_many(self, image_names, max_workers=8, deadline=None):
+        """
+        Gets the tags for several images from the default registry,
+        see Registry.get_image_tags_many()
+        """
+        return self._get_default().get_image_tags_many(image_names, max_workers, deadline)
+
+    def close(self):
+        """
+        Closes all pooled connections of all registries
+        """
+        with self._lock:
+            registries = list(self._registries.values())
+        if self.default:
+            registries.append(self.default)
+        for registry in registries:
+            registry.close()
+
+    def _get_default(self):
+        if self.default is None:
+            raise RegistryRouterException('No default registry configured')
+        return self.default
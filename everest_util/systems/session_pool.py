@@ -0,0 +1,44 @@
+"""
+Module to share one pooled transport adapter between per thread requests sessions
+"""
+__author__ = 'tinglev@kth.se'
+
+import threading
+import requests
+
+class SessionPool(object):
+    """
+    Keeps one requests Session per thread, all mounted on the same transport
+    adapter. The adapter holds the (thread safe) connection pool, so connections
+    are reused across threads, while each thread has a Session of its own.
+    """
+
+    def __init__(self, adapter):
+        """
+        Constructor
+
+        Args:
+            adapter: the requests transport adapter to mount for http and https
+                     (for instance an HTTPAdapter with a pool_maxsize)
+        """
+        self.adapter = adapter
+        self._local = threading.local()
+
+    def get(self):
+        """
+        Returns:
+            requests.Session: the session of the calling thread, created on first use
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            self._local.session = session
+        return session
+
+    def close(self):
+        """
+        Closes all pooled connections of the adapter
+        """
+        self.adapter.close()
@@ -7,10 +7,16 @@ https://api.slack.com/docs/messages
 
 __author__ = 'tinglev@kth.se'
 
+import json
+import time
+import hashlib
 import logging
-import requests
+import threading
 from requests import HTTPError, ConnectTimeout, RequestException
+from requests.adapters import HTTPAdapter
 from everest_util.base_exception import EverestException
+from everest_util.flow_control import TokenBucket, DuplicateFilter
+from everest_util.systems.session_pool import SessionPool
 
 class SlackHTTPErrorException(EverestException):
     """
@@ -43,15 +49,45 @@ class Slack(object):
     The class
     """
 
-    def __init__(self, webhook_url):
+    MAX_ATTACHMENTS = 20
+
+    # Token buckets are shared by all instances using the same webhook, rate and burst
+    _rate_limiters = {}
+    _rate_limiters_lock = threading.Lock()
+
+    def __init__(self, webhook_url, rate=None, burst=1, max_retries=3, max_retry_after=60,
+                 timeout=30, pool_size=10, dedup_window=None, dedup_size=1024):
         """
         Constructor for the Slack class
 
         Args:
             webhook_url: the webhook url to use for this class instance
+            rate: the max number of messages per second sent to the webhook (Slack
+                  allows about 1), None sends without limit. The limit is shared
+                  with all Slack instances for the same webhook, rate and burst.
+            burst: the max number of messages sent at once after a quiet period
+            max_retries: the number of times to resend a message answered with 429,
+                         after waiting for its Retry-After, 0 raises right away
+            max_retry_after: the max number of seconds to wait before a retry, a
+                             longer Retry-After is cut down to it, so a call is held
+                             up for at most max_retries * max_retry_after seconds
+            timeout: timeout in seconds for each request, None waits forever
+            pool_size: the max number of keep-alive connections kept open to Slack
+            dedup_window: if set, identical payloads sent within this many seconds
+                          are suppressed, and the number of suppressed payloads is
+                          added to the text of the next payload sent to the channel
+            dedup_size: the max number of payload hashes remembered for dedup_window
         """
         self.log = logging.getLogger(__name__)
         self.webhook_url = webhook_url
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+        self.rate_limiter = Slack._get_rate_limiter(webhook_url, rate, burst) if rate else None
+        self.duplicate_filter = None
+        if dedup_window:
+            self.duplicate_filter = DuplicateFilter(dedup_window, dedup_size)
+        self._sessions = SessionPool(HTTPAdapter(pool_maxsize=pool_size))
 
     def add_attachement_to_body(self, body, attachment):
         """
@@ -71,7 +107,7 @@ class Slack(object):
         attachments_field = 'attachments'
         if not attachments_field in body:
             body[attachments_field] = []
-        if len(body[attachments_field]) > 19:
+        if len(body[attachments_field]) >= Slack.MAX_ATTACHMENTS:
             raise SlackTooManyAttachmentsException
         body[attachments_field].append(attachment)
         return body
@@ -121,6 +157,28 @@ class Slack(object):
             "icon_emoji": icon
         }
 
+    def create_payload_bodies(self, channel, text, username, icon, attachments):
+        """
+        Creates as few payload bodies as needed to carry all given attachments,
+        with at most MAX_ATTACHMENTS attachments in each
+
+        Args:
+            channel: the channel to send the messages to
+            text: the text of the messages
+            username: the username to show as the sender in Slack for the messages
+            icon: the emoji to use for the messages (for instance :+1:)
+            attachments: an array of attachments (see create_payload_attachment())
+
+        Returns:
+            array: valid Slack payload body json objects, at least one
+        """
+        bodies = []
+        for start in range(0, len(attachments), Slack.MAX_ATTACHMENTS):
+            body = self.create_payload_body(channel, text, username, icon)
+            body['attachments'] = attachments[start:start + Slack.MAX_ATTACHMENTS]
+            bodies.append(body)
+        return bodies or [self.create_payload_body(channel, text, username, icon)]
+
     def call_slack_endpoint(self, payload):
         """
         Makes the actual REST call to the webhook url with a given payload
@@ -129,21 +187,99 @@ class Slack(object):
             payload: a json object with the Slack payload to send
 
         Returns:
-            response: the requests.response object returned from the call
+            response: the requests.response object returned from the call, or None
+                      if the payload was suppressed as a duplicate
 
         Raises:
             Wrapped exceptions (see above)
         """
+        if not self.duplicate_filter:
+            return self._post_payload(payload)
+        key = Slack.get_payload_hash(payload)
+        channel = payload.get('channel')
+        if self.duplicate_filter.is_duplicate(key, channel):
+            self.log.debug('Suppressed duplicate Slack payload to %s', channel)
+            return None
+        suppressed = self.duplicate_filter.take_suppressed(channel)
+        try:
+            return self._post_payload(Slack._add_suppressed_count(payload, suppressed))
+        except EverestException:
+            # Let the payload (and the count) through when it is sent again
+            self.duplicate_filter.forget(key)
+            self.duplicate_filter.add_suppressed(suppressed, channel)
+            raise
+
+    @staticmethod
+    def get_payload_hash(payload):
+        """
+        Args:
+            payload: a json object with a Slack payload
+
+        Returns:
+            string: a hash of the content of the payload
+        """
+        return hashlib.sha1(json.dumps(payload, sort_keys=True, separators=(',', ':'))).digest()
+
+    def close(self):
+        """
+        Closes all pooled connections to Slack
+        """
+        self._sessions.close()
+
+    def _post_payload(self, payload):
         try:
-            self.log.debug('Calling Slack with payload "%s"', payload)
-            response = requests.post(self.webhook_url, json=payload)
-            response.raise_for_status()
-            self.log.debug('Response was "%s"', response.text)
-            return response
+            retries = 0
+            while True:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                self.log.debug('Calling Slack with payload "%s"', payload)
+                response = self._sessions.get().post(self.webhook_url, json=payload,
+                                                    timeout=self.timeout)
+                if response.status_code == 429 and retries < self.max_retries:
+                    retries += 1
+                    self._back_off(response)
+                    continue
+                response.raise_for_status()
+                self.log.debug('Response was "%s"', response.text)
+                return response
         except HTTPError as http_err:
             raise SlackHTTPErrorException('HTTP error when calling Slack', ex=http_err)
         except ConnectTimeout as timeout_err:
             raise SlackTimeoutException('Timeout when calling Slack', ex=timeout_err)
         except RequestException as request_err:
             raise SlackRequestException('Request error when calling Slack', ex=request_err)
-                     
\ No newline at end of file
+
+    @staticmethod
+    def _add_suppressed_count(payload, suppressed):
+        if not suppressed:
+            return payload
+        payload = dict(payload)
+        note = '({} identical {} suppressed)'.format(
+            suppressed, 'message' if suppressed == 1 else 'messages')
+        payload['text'] = '{} {}'.format(payload['text'], note) if payload.get('text') else note
+        return payload
+
+    @staticmethod
+    def _get_rate_limiter(webhook_url, rate, burst):
+        with Slack._rate_limiters_lock:
+            key = (webhook_url, rate, burst)
+            rate_limiter = Slack._rate_limiters.get(key)
+            if rate_limiter is None:
+                rate_limiter = Slack._rate_limiters[key] = TokenBucket(rate, burst)
+            return rate_limiter
+
+    def _back_off(self, response):
+        """
+        Waits for the Retry-After of a 429 response (or one second), at most
+        max_retry_after seconds. With a rate limiter, all senders to the webhook wait.
+        """
+        try:
+            wait = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            wait = 1
+        wait = min(max(wait, 0), self.max_retry_after)
+        self.log.debug('Slack is rate limiting, retrying in %s seconds', wait)
+        if self.rate_limiter:
+            self.rate_limiter.pause(wait)
+        else:
+            time.sleep(wait)
@@ -0,0 +1,154 @@
+"""
+Module to coalesce Slack notifications into digests, so that a burst of
+notifications is sent as a few multi-attachment messages per channel
+"""
+__author__ = 'tinglev@kth.se'
+
+import logging
+import threading
+from everest_util.base_exception import EverestException
+
+class SlackDigest(object):
+    """
+    Collects notifications (Slack attachments) per channel. A channel is sent
+    as a digest when its oldest notification has waited for the time window,
+    or when it holds max_size notifications, whichever comes first. Each
+    digest is split into as few payloads as Slack.MAX_ATTACHMENTS allows.
+    """
+
+    def __init__(self, slack, username, icon, window=10, max_size=100,
+                 text='{count} notifications', send=None):
+        """
+        Constructor
+
+        Args:
+            slack: the Slack instance to create (and by default send) the payloads with
+            username: the username to show as the sender of the digests
+            icon: the emoji to use for the digests (for instance :+1:)
+            window: the max number of seconds a notification waits for others,
+                    None only sends on size or flush()
+            max_size: the max number of notifications in a digest
+            text: the text of the digests, formatted with the number of notifications
+                  as count
+            send: the function to send each payload with, None uses
+                  slack.call_slack_endpoint (BackgroundSlackSender.send also fits)
+        """
+        self.slack = slack
+        self.username = username
+        self.icon = icon
+        self.window = window
+        self.max_size = max_size
+        self.text = text
+        self.send = send or slack.call_slack_endpoint
+        self.notifications = 0
+        self.payloads = 0
+        self._pending = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+        self.log = logging.getLogger(__name__)
+
+    def add(self, channel, attachment):
+        """
+        Adds a notification to the digest of a channel, and sends the digest if
+        it is full
+
+        Args:
+            channel: the channel to send the notification to
+            attachment: the notification, as a Slack attachment
+                        (see Slack.create_payload_attachment())
+        """
+        with self._lock:
+            self.notifications += 1
+            attachments = self._pending.setdefault(channel, [])
+            attachments.append(attachment)
+            if len(attachments) < self.max_size:
+                if self.window is not None and channel not in self._timers:
+                    timer = threading.Timer(self.window, self._flush_expired, [channel])
+                    timer.daemon = True
+                    self._timers[channel] = timer
+                    timer.start()
+                return
+            attachments = self._take(channel)
+        self._send_digest(channel, attachments)
+
+    def flush(self, channel=None):
+        """
+        Sends the collected notifications right away
+
+        Args:
+            channel: the channel to send the digest for, None sends all channels
+
+        Returns:
+            int: the number of payloads sent
+        """
+        with self._lock:
+            channels = [channel] if channel is not None else list(self._pending)
+            digests = [(name, self._take(name)) for name in channels]
+        return sum(self._send_digest(name, attachments)
+                   for name, attachments in digests if attachments)
+
+    def close(self):
+        """
+        Sends everything collected, and stops the window timers
+        """
+        self.flush()
+
+    def get_pending(self, channel):
+        """
+        Returns:
+            int: the number of notifications waiting to be sent to the channel
+        """
+        with self._lock:
+            return len(self._pending.get(channel, []))
+
+    def create_digest_payloads(self, channel, attachments):
+        """
+        Creates the payloads of a digest. When a digest needs more than one payload,
+        their texts are numbered.
+
+        Args:
+            channel: the channel of the digest
+            attachments: the notifications of the digest
+
+        Returns:
+            array: the Slack payload bodies
+        """
+        text = self.text.format(count=len(attachments))
+        bodies = self.slack.create_payload_bodies(channel, text, self.username, self.icon,
+                                                  attachments)
+        if len(bodies) > 1:
+            for part, body in enumerate(bodies, 1):
+                body['text'] = '{} ({}/{})'.format(text, part, len(bodies))
+        return bodies
+
+    def _take(self, channel):
+        """
+        Removes and returns the notifications of a channel, the lock must be held
+        """
+        timer = self._timers.pop(channel, None)
+        if timer:
+            timer.cancel()
+        return self._pending.pop(channel, [])
+
+    def _send_digest(self, channel, attachments):
+        payloads = self.create_digest_payloads(channel, attachments)
+        self.log.debug('Sending %s notifications to %s in %s payloads',
+                       len(attachments), channel, len(payloads))
+        for payload in payloads:
+            self.send(payload)
+            with self._lock:
+                self.payloads += 1
+        return len(payloads)
+
+    def _flush_expired(self, channel):
+        with self._lock:
+            # The digest may have been sent (and a new one started) while this
+            # timer was firing
+            if self._timers.get(channel) is not threading.current_thread():
+                return
+            attachments = self._take(channel)
+        try:
+            self._send_digest(channel, attachments)
+        except EverestException as ex:
+            # Runs on a timer thread, where there is no caller to raise to
+            self.log.warning('Could not send Slack digest to %s: %s', channel, ex)
@@ -0,0 +1,249 @@
+"""
+Module for a crash safe, disk spooled outbox of Slack messages
+"""
+__author__ = 'tinglev@kth.se'
+
+import os
+import json
+import logging
+import threading
+from everest_util.base_exception import EverestException
+
+class SlackOutboxException(EverestException):
+    """
+    Exception raised when the outbox files can't be used
+    """
+    pass
+
+class SlackOutbox(object):
+    """
+    Append only outbox of Slack payloads. put() appends a payload as a line of
+    json to the outbox file, and a drainer delivers the lines in batches. The
+    byte offset of the first undelivered line is saved after every batch, so
+    a restarted process resumes where the previous one stopped. A payload may
+    be delivered twice if the process dies in the middle of a batch.
+
+    The outbox file is emptied when everything in it has been delivered. Only
+    one process at a time should use an outbox file.
+    """
+
+    def __init__(self, slack, path, batch_size=50, fsync=False, send=None):
+        """
+        Constructor
+
+        Args:
+            slack: the Slack instance to (by default) send the payloads with
+            path: the path of the outbox file, the offset is saved next to it
+                  in <path>.offset
+            batch_size: the max number of payloads delivered between offset saves
+            fsync: if True, put() also fsyncs the outbox file, so that payloads
+                   survive a crash of the machine and not only of the process
+            send: the function to send each payload with, None uses
+                  slack.call_slack_endpoint
+
+        Raises:
+            SlackOutboxException: if the outbox file can't be opened
+        """
+        self.slack = slack
+        self.path = path
+        self.offset_path = '{}.offset'.format(path)
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.send = send or slack.call_slack_endpoint
+        self.delivered = 0
+        self.failed = 0
+        self._offset = self._read_offset()
+        self._write_lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.log = logging.getLogger(__name__)
+        try:
+            self._file = open(path, 'ab')
+            self._end_partial_line()
+        except (IOError, OSError) as io_err:
+            raise SlackOutboxException('Could not open Slack outbox {}'.format(path), ex=io_err)
+
+    def put(self, payload):
+        """
+        Appends a payload to the outbox
+
+        Args:
+            payload: a json object with the Slack payload to send
+        """
+        line = '{}\n'.format(json.dumps(payload, separators=(',', ':')))
+        with self._write_lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        self._wake_up.set()
+
+    def drain(self, max_batches=None):
+        """
+        Delivers the payloads in the outbox, in batches. Stops at the first
+        payload that can't be delivered, which is retried on the next drain.
+
+        Args:
+            max_batches: the max number of batches to deliver, None delivers everything
+
+        Returns:
+            int: the number of payloads delivered
+        """
+        delivered = 0
+        batches = 0
+        with self._drain_lock:
+            while max_batches is None or batches < max_batches:
+                batch, next_offsets = self._read_batch()
+                if not batch:
+                    self._compact()
+                    break
+                sent = self._deliver(batch)
+                delivered += sent
+                batches += 1
+                if sent:
+                    self._save_offset(next_offsets[sent - 1])
+                if sent < len(batch):
+                    break
+        return delivered
+
+    def start(self, interval=1.0):
+        """
+        Starts a thread that drains the outbox whenever payloads are put, and
+        at least every interval seconds (to retry failed deliveries)
+
+        Returns:
+            self: for chaining purposes
+        """
+        def run():
+            while not self._stopped:
+                self._wake_up.wait(interval)
+                self._wake_up.clear()
+                self.drain()
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self, timeout=None):
+        """
+        Stops the drainer thread, delivers what is left and closes the outbox file
+
+        Args:
+            timeout: the max number of seconds to wait for the drainer thread
+        """
+        self._stopped = True
+        self._wake_up.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.drain()
+        with self._write_lock:
+            self._file.close()
+
+    def is_empty(self):
+        """
+        Returns:
+            bool: True if everything put in the outbox has been delivered
+        """
+        with self._write_lock:
+            return self._file.tell() <= self._offset
+
+    def count_pending(self):
+        """
+        Returns:
+            int: the number of payloads in the outbox not delivered yet
+        """
+        with self._write_lock:
+            offset = self._offset
+        with open(self.path, 'rb') as outbox_file:
+            outbox_file.seek(offset)
+            return sum(1 for line in outbox_file if line.endswith('\n') and line.strip())
+
+    def _read_batch(self):
+        """
+        Returns:
+            tuple: the next payloads to deliver, and the offset after each of them
+        """
+        batch = []
+        next_offsets = []
+        with open(self.path, 'rb') as outbox_file:
+            outbox_file.seek(self._offset)
+            while len(batch) < self.batch_size:
+                line = outbox_file.readline()
+                if not line.endswith('\n'):
+                    # Nothing more, or a line that is still being written
+                    break
+                try:
+                    payload = json.loads(line)
+                except ValueError:
+                    if batch:
+                        # Skipped first thing in the next batch, so that the saved
+                        # offset never passes an undelivered payload
+                        break
+                    self.log.warning('Skipping corrupt line at offset %s in Slack outbox %s',
+                                     self._offset, self.path)
+                    self._save_offset(outbox_file.tell())
+                    continue
+                batch.append(payload)
+                next_offsets.append(outbox_file.tell())
+        return batch, next_offsets
+
+    def _deliver(self, batch):
+        """
+        Returns:
+            int: the number of payloads in the batch delivered before the first failure
+        """
+        for sent, payload in enumerate(batch):
+            try:
+                self.send(payload)
+            except EverestException as ex:
+                self.failed += 1
+                self.log.warning('Could not deliver Slack message from outbox, will retry: %s',
+                                 ex)
+                return sent
+            self.delivered += 1
+        return len(batch)
+
+    def _compact(self):
+        """
+        Empties the outbox file if everything in it has been delivered
+        """
+        with self._write_lock:
+            if self._offset and self._file.tell() <= self._offset:
+                self._file.truncate(0)
+                self._file.seek(0)
+                self._save_offset(0)
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path, 'r') as offset_file:
+                offset = int(offset_file.read().strip() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+        if not os.path.exists(self.path) or offset > os.path.getsize(self.path):
+            # The outbox file was replaced after the offset was saved
+            return 0
+        return offset
+
+    def _save_offset(self, offset):
+        temp_path = '{}.tmp'.format(self.offset_path)
+        with open(temp_path, 'w') as offset_file:
+            offset_file.write(str(offset))
+        # Rename is atomic, so a crash leaves either the old or the new offset
+        os.rename(temp_path, self.offset_path)
+        self._offset = offset
+
+    def _end_partial_line(self):
+        """
+        Ends a line left half written by a crash, so that it isn't merged with
+        the next payload
+        """
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        if size:
+            with open(self.path, 'rb') as outbox_file:
+                outbox_file.seek(size - 1)
+                if outbox_file.read(1) != '\n':
+                    self._file.write('\n')
+                    self._file.flush()
@@ -0,0 +1,238 @@
+"""
+Module to send Slack messages in the background, so that posting a
+notification doesn't wait for Slack
+"""
+__author__ = 'tinglev@kth.se'
+
+import time
+import logging
+import threading
+from collections import deque
+from everest_util.base_exception import EverestException
+from everest_util.systems.slack_outbox import SlackOutbox
+
+class SlackSenderException(EverestException):
+    """
+    Exception raised on invalid sender configuration, or when sending on a
+    closed sender
+    """
+    pass
+
+class BackgroundSlackSender(object):
+    """
+    Queues Slack payloads in a bounded in-memory queue, which a worker thread
+    sends in order. What happens when the queue is full is decided by the
+    overflow policy:
+
+    drop_oldest: the oldest queued payload is dropped to make room
+    block: send() waits for room in the queue
+    spill: the payload is put in a SlackOutbox, and is sent after the payloads
+           queued before it
+    """
+
+    OVERFLOW_POLICIES = ('drop_oldest', 'block', 'spill')
+
+    def __init__(self, slack, max_queue_size=1000, overflow='drop_oldest', spill_path=None):
+        """
+        Constructor, starts the worker thread
+
+        Args:
+            slack: the Slack instance to send the payloads with
+            max_queue_size: the max number of payloads to keep in memory
+            overflow: the overflow policy, one of OVERFLOW_POLICIES
+            spill_path: the SlackOutbox file to spill payloads to, required by the spill
+                        policy. Payloads left in it by a previous sender are sent too.
+
+        Raises:
+            SlackSenderException: on an unknown overflow policy or a missing spill_path
+            SlackOutboxException: if the spill file can't be opened
+        """
+        if overflow not in BackgroundSlackSender.OVERFLOW_POLICIES:
+            raise SlackSenderException('Unknown overflow policy "{}"'.format(overflow))
+        if overflow == 'spill' and not spill_path:
+            raise SlackSenderException('The spill overflow policy requires a spill_path')
+        self.slack = slack
+        self.max_queue_size = max_queue_size
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._sending = False
+        self._closed = False
+        self._outbox = None
+        self._spill_pending = 0
+        if overflow == 'spill':
+            # Spilled payloads are sent by this sender's worker, and like queued
+            # payloads are counted as failed rather than retried
+            self._outbox = SlackOutbox(slack, spill_path, batch_size=max_queue_size,
+                                       send=self._deliver)
+            self._spill_pending = self._outbox.count_pending()
+        self.log = logging.getLogger(__name__)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, payload, timeout=None):
+        """
+        Queues a payload to be sent by the worker thread
+
+        Args:
+            payload: a json object with the Slack payload to send
+            timeout: the max number of seconds to wait for room in the queue with
+                     the block overflow policy, None waits forever
+
+        Returns:
+            bool: True if the payload was queued (or spilled), False if the queue
+                  stayed full for the whole timeout
+
+        Raises:
+            SlackSenderException: if the sender is closed
+        """
+        with self._condition:
+            if self._closed:
+                raise SlackSenderException('Can not send on a closed Slack sender')
+            if self.overflow == 'spill' and self._spill_pending:
+                # Keep the order, payloads spilled earlier are sent first
+                self._spill(payload)
+                return True
+            if len(self._queue) >= self.max_queue_size:
+                if self.overflow == 'drop_oldest':
+                    self._queue.popleft()
+                    self.dropped += 1
+                elif self.overflow == 'spill':
+                    self._spill(payload)
+                    return True
+                elif not self._wait_for(self._has_room, timeout):
+                    self.dropped += 1
+                    return False
+                if self._closed:
+                    raise SlackSenderException('Slack sender was closed while waiting to send')
+            self._queue.append(payload)
+            self._condition.notify_all()
+            return True
+
+    def flush(self, timeout=None):
+        """
+        Waits until all queued and spilled payloads have been sent
+
+        Args:
+            timeout: the max number of seconds to wait, None waits forever
+
+        Returns:
+            bool: True if everything was sent, False on timeout
+        """
+        with self._condition:
+            return self._wait_for(self._is_idle, timeout)
+
+    def close(self, timeout=None):
+        """
+        Sends the remaining payloads and stops the worker thread. Nothing can be
+        sent after close.
+
+        Args:
+            timeout: the max number of seconds to wait, None waits forever
+
+        Returns:
+            bool: True if everything was sent, False on timeout
+        """
+        flushed = self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if flushed:
+            self._thread.join()
+            if self._outbox:
+                self._outbox.close()
+        return flushed
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: the number of sent, failed, dropped and spilled payloads, and
+                  the number of payloads waiting in the queue and outbox
+        """
+        with self._condition:
+            return dict(sent=self.sent, failed=self.failed, dropped=self.dropped,
+                        spilled=self.spilled,
+                        queued=len(self._queue) + self._spill_pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _has_room(self):
+        return self._closed or len(self._queue) < self.max_queue_size
+
+    def _is_idle(self):
+        return not (self._queue or self._spill_pending or self._sending)
+
+    def _wait_for(self, predicate, timeout):
+        """
+        Waits on the condition until predicate() is true, the condition lock must be held
+
+        Returns:
+            bool: the last value of predicate()
+        """
+        deadline_at = time.time() + timeout if timeout is not None else None
+        while not predicate():
+            if deadline_at is None:
+                self._condition.wait()
+            else:
+                time_left = deadline_at - time.time()
+                if time_left <= 0:
+                    break
+                self._condition.wait(time_left)
+        return predicate()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not (self._queue or self._spill_pending or self._closed):
+                    self._condition.wait()
+                if not (self._queue or self._spill_pending):
+                    return
+                payload = self._queue.popleft() if self._queue else None
+                self._sending = True
+                self._condition.notify_all()
+            if payload is None:
+                self._drain_spilled()
+            else:
+                self._deliver(payload)
+            with self._condition:
+                self._sending = False
+                self._condition.notify_all()
+
+    def _drain_spilled(self):
+        """
+        Sends the next batch of spilled payloads, once the queue is empty
+        """
+        delivered = self._outbox.drain(max_batches=1)
+        with self._condition:
+            if self._outbox.is_empty():
+                self._spill_pending = 0
+            else:
+                self._spill_pending = max(self._spill_pending - delivered, 1)
+
+    def _deliver(self, payload):
+        try:
+            self.slack.call_slack_endpoint(payload)
+            self.sent += 1
+        except Exception as ex: # pylint: disable=W0703
+            # The worker must survive any failure to keep sending
+            self.failed += 1
+            self.log.warning('Could not send queued Slack message: %s', ex)
+
+    def _spill(self, payload):
+        """
+        Puts a payload in the outbox, the condition lock must be held
+        """
+        self._outbox.put(payload)
+        self.spilled += 1
+        self._spill_pending += 1
+        self._condition.notify_all()
@@ -3,21 +3,96 @@ Module for handling static and semver versioning of docker images
 """
 __author__ = 'tinglev@kth.se'
 
-import re
 from everest_util.regex import Regex
 from everest_util.base_exception import EverestException
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class VersionException(EverestException):
     """
     Raised when an error occurs during processing
     """
     pass
 
+class ParsedVersion(object):
+    """
+    A static version parsed once into its integer parts. Instances are memoized
+    by version string, so a tag that shows up for many images or in many registry
+    scans is only run through the regex once.
+    """
+
+    __slots__ = ('major', 'minor', 'build', 'suffix', 'version')
+
+    _cache = {}
+    _CACHE_MAX_SIZE = 100000
+
+    def __init__(self, major, minor, build, suffix, version):
+        """
+        Constructor
+
+        Args:
+            major: the major part as an int
+            minor: the minor part as an int
+            build: the build part as an int
+            suffix: everything after the build part (for instance '_abc1234'), or ''
+            version: the original version string
+        """
+        self.major = major
+        self.minor = minor
+        self.build = build
+        self.suffix = suffix
+        self.version = version
+
+    @staticmethod
+    def parse(version):
+        """
+        Parses a static version. Validation is performed against
+        Regex.get_static_version_regex()
+
+        Args:
+            version: the version string (for instance '1.2.3_abc')
+
+        Returns:
+            ParsedVersion: the parsed version, or None if the version is invalid
+        """
+        try:
+            return ParsedVersion._cache[version]
+        except KeyError:
+            pass
+        parsed = None
+        match = Regex.get_compiled(Regex.get_static_version_regex()).match(version)
+        if match:
+            parsed = ParsedVersion(int(match.group(1)), int(match.group(2)),
+                                   int(match.group(3)), match.group(4), version)
+        if len(ParsedVersion._cache) >= ParsedVersion._CACHE_MAX_SIZE:
+            ParsedVersion._cache.clear()
+        ParsedVersion._cache[version] = parsed
+        return parsed
+
+    def sort_key(self):
+        """
+        Returns:
+            tuple: (major, minor, build), used to order versions
+        """
+        return (self.major, self.minor, self.build)
+
+    def __repr__(self):
+        """
+        Representation override
+        """
+        return 'ParsedVersion({!r})'.format(self.version)
+
 class Version(object):
     """
     Static class
     """
 
+    # Lists at least this long are sorted and indexed with numpy, when it is installed
+    NUMPY_MIN_VERSIONS = 5000
+
     @staticmethod
     def get_sorted_valid_versions(versions):
         """
@@ -28,8 +103,44 @@ class Version(object):
         Returns:
             array: the list of versions sorted, with all invalid versions removed
         """
-        versions_to_sort = [version for version in versions if Version._is_valid_static(version)]
-        return sorted(versions_to_sort, cmp=Version._sort_compare)
+        if numpy is not None and len(versions) >= Version.NUMPY_MIN_VERSIONS:
+            try:
+                return VersionArray(versions).get_sorted_versions()
+            except VersionException:
+                # A version part too large for int64, the Python path handles any size
+                pass
+        return [parsed.version for parsed in Version.get_sorted_parsed_versions(versions)]
+
+    @staticmethod
+    def create_index(versions):
+        """
+        Creates an index to resolve semver strings against a list of versions.
+        Lists of at least NUMPY_MIN_VERSIONS versions get a VersionArray, when
+        numpy is installed, and shorter lists a VersionIndex.
+        Args:
+            versions: an array of versions, invalid versions are ignored
+        Returns:
+            VersionIndex or VersionArray: the index, both have best_match()
+        """
+        if numpy is not None and len(versions) >= Version.NUMPY_MIN_VERSIONS:
+            try:
+                return VersionArray(versions)
+            except VersionException:
+                # A version part too large for int64, the Python path handles any size
+                pass
+        return VersionIndex(versions)
+
+    @staticmethod
+    def get_sorted_parsed_versions(versions):
+        """
+        Same as get_sorted_valid_versions(), but returns the parsed versions
+        Args:
+            versions: an array of versions (for instance ['1.2.3_abc', '1.2', 'latest'])
+        Returns:
+            array: the ParsedVersion for every valid version, highest version first
+        """
+        parsed_versions = [parsed for parsed in map(ParsedVersion.parse, versions) if parsed]
+        return sorted(parsed_versions, key=ParsedVersion.sort_key, reverse=True)
 
     @staticmethod
     def get_best_semver_match(sorted_valid_versions, semver_string):
@@ -43,38 +154,105 @@ class Version(object):
         Raises:
             VersionException: on invalid semver_string or if no match was found
         """
-        if not Version._is_valid_semver(semver_string):
+        match = Version._is_valid_semver(semver_string)
+        if not match:
             raise VersionException('Semver version under service environment is invalid: "{}"'
                                    .format(semver_string))
-        for ver in sorted_valid_versions:
-            max_build = Version._semver_max_build(semver_string)
-            max_minor = Version._semver_max_minor(semver_string)
-            if Version._get_major(ver) == Version._get_major(semver_string):
-                if max_minor:
-                    return ver
-                if Version._get_minor(ver) == Version._get_minor(semver_string):
-                    if max_build:
-                        return ver
-                    if Version._get_build(ver) == Version._get_build(semver_string):
-                        return ver
+        major, minor = int(match.group(1)), int(match.group(2))
+        max_minor = Version._semver_max_minor(semver_string)
+        # The list is sorted highest version first, so the first match is the best.
+        # Use a VersionIndex to resolve many semver strings against the same list.
+        for version in sorted_valid_versions:
+            parsed = ParsedVersion.parse(version)
+            if parsed and parsed.major == major and (max_minor or parsed.minor == minor):
+                return version
         raise VersionException('No image found for requested version "{}"'
                                .format(semver_string))
 
     @staticmethod
-    def _is_valid_semver(version_string):
-        return re.match(Regex.get_semver_version_regex(), version_string)
+    def resolve_many(versions, semver_strings):
+        """
+        Resolves several semver versions against the same list of versions. The
+        list is validated and indexed once for all semver strings (see create_index()).
+        Args:
+            versions: an array of versions, as returned from the registry
+            semver_strings: an array of semver strings (for instance ['^1.2.0', '~1.1.0'])
+        Returns:
+            dict: semver string -> best matching version, or the VersionException
+                  raised when resolving that semver string
+        """
+        index = Version.create_index(versions)
+        result = {}
+        for semver_string in semver_strings:
+            try:
+                result[semver_string] = index.best_match(semver_string)
+            except VersionException as ver_ex:
+                result[semver_string] = ver_ex
+        return result
 
     @staticmethod
-    def _is_valid_static(version_string):
-        return re.match(Regex.get_static_version_regex(), version_string)
+    def stream_best_matches(versions, semver_strings):
+        """
+        Resolves several semver versions in a single pass over an iterable of
+        versions, for instance a generator of paginated registry tags. Only the
+        best candidate so far for each semver string is kept, the versions are
+        never collected or sorted.
+        Args:
+            versions: an iterable of versions
+            semver_strings: an array of semver strings (for instance ['^1.2.0', '~1.1.0'])
+        Returns:
+            dict: semver string -> best matching version, or the VersionException
+                  for that semver string (same format as resolve_many())
+        """
+        result = {}
+        wanted_majors = set()
+        wanted_minors = set()
+        for semver_string in semver_strings:
+            match = Version._is_valid_semver(semver_string)
+            if not match:
+                result[semver_string] = VersionException('Semver version under service '
+                                                         'environment is invalid: "{}"'
+                                                         .format(semver_string))
+            elif Version._semver_max_minor(semver_string):
+                wanted_majors.add(int(match.group(1)))
+            else:
+                wanted_minors.add((int(match.group(1)), int(match.group(2))))
+        best_by_major = {}
+        best_by_minor = {}
+        # Streamed tags are seen once, so they are matched directly instead of
+        # through ParsedVersion.parse(), which would fill its cache with them
+        static_version_regex = Regex.get_compiled(Regex.get_static_version_regex())
+        for version in versions:
+            match = static_version_regex.match(version)
+            if not match:
+                continue
+            key = (int(match.group(1)), int(match.group(2)), int(match.group(3)))
+            if key[0] in wanted_majors:
+                VersionIndex._add(best_by_major, key[0], key, version)
+            if key[:2] in wanted_minors:
+                VersionIndex._add(best_by_minor, key[:2], key, version)
+        for semver_string in semver_strings:
+            if semver_string in result:
+                continue
+            match = Version._is_valid_semver(semver_string)
+            if Version._semver_max_minor(semver_string):
+                candidate = best_by_major.get(int(match.group(1)))
+            else:
+                candidate = best_by_minor.get((int(match.group(1)), int(match.group(2))))
+            if candidate:
+                result[semver_string] = candidate[1]
+            else:
+                result[semver_string] = VersionException('No image found for requested '
+                                                         'version "{}"'.format(semver_string))
+        return result
+
+    @staticmethod
+    def _is_valid_semver(version_string):
+        return Regex.get_compiled(Regex.get_semver_version_regex()).match(version_string)
 
     @staticmethod
-    def _sort_compare(ver1, ver2):
-        if Version._get_major(ver1) == Version._get_major(ver2):
-            if Version._get_minor(ver1) == Version._get_minor(ver2):
-                return Version._get_build(ver2) - Version._get_build(ver1)
-            return Version._get_minor(ver2) - Version._get_minor(ver1)
-        return Version._get_major(ver2) - Version._get_major(ver1)
+    def _is_valid_static(version_string):
+        return Regex.get_compiled(Regex.get_static_version_regex()).match(version_string)
 
     @staticmethod
     def _get_major(version):
@@ -102,3 +280,136 @@ class Version(object):
     @staticmethod
     def _semver_max_build(semver_string):
         return str.startswith(semver_string, '~')
+
+
+class VersionIndex(object):
+    """
+    Index over a list of static versions, built once and queried many times.
+    Versions are held as parsed (major, minor, build) tuples and the best
+    candidate for every major and every major.minor is resolved up front, so that
+    a semver lookup is a dict lookup instead of a scan of the whole list.
+    """
+
+    def __init__(self, versions):
+        """
+        Constructor
+
+        Args:
+            versions: an array of static versions, invalid versions are ignored.
+                      When several versions share the same major.minor.build the
+                      first one in the array wins, so passing the output of
+                      Version.get_sorted_valid_versions() gives the same result as
+                      a scan of that list.
+        """
+        self._best_by_major = {}
+        self._best_by_minor = {}
+        for parsed in map(ParsedVersion.parse, versions):
+            if parsed:
+                key = parsed.sort_key()
+                self._add(self._best_by_major, key[0], key, parsed.version)
+                self._add(self._best_by_minor, key[:2], key, parsed.version)
+
+    def best_match(self, semver_string):
+        """
+        Returns the best match for a given semver version
+
+        Args:
+            semver_string: the semver string to process (for instance '~1.2.0')
+
+        Returns:
+            string: the version in the index that best matches the semver string
+
+        Raises:
+            VersionException: on invalid semver_string or if no match was found
+        """
+        match = Version._is_valid_semver(semver_string)
+        if not match:
+            raise VersionException('Semver version under service environment is invalid: "{}"'
+                                   .format(semver_string))
+        major, minor = int(match.group(1)), int(match.group(2))
+        if Version._semver_max_minor(semver_string):
+            candidate = self._best_by_major.get(major)
+        else:
+            candidate = self._best_by_minor.get((major, minor))
+        if candidate:
+            return candidate[1]
+        raise VersionException('No image found for requested version "{}"'
+                               .format(semver_string))
+
+    @staticmethod
+    def _add(groups, group_key, sort_key, version):
+        current = groups.get(group_key)
+        if not current or sort_key > current[0]:
+            groups[group_key] = (sort_key, version)
+
+
+class VersionArray(object):
+    """
+    NumPy backed alternative to VersionIndex for very long version lists. The
+    versions are held as integer arrays (major, minor, build) ordered with lexsort,
+    and semver lookups are answered with vectorized masks over those arrays.
+    Gives the same results as the pure Python path. Requires numpy.
+    """
+
+    def __init__(self, versions):
+        """
+        Constructor
+
+        Args:
+            versions: an array of versions, invalid versions are ignored
+
+        Raises:
+            VersionException: if numpy is not installed, or if a version has a part
+                              that doesn't fit in an int64
+        """
+        if numpy is None:
+            raise VersionException('VersionArray requires numpy to be installed')
+        parsed_versions = [parsed for parsed in map(ParsedVersion.parse, versions) if parsed]
+        try:
+            majors = numpy.array([parsed.major for parsed in parsed_versions],
+                                 dtype=numpy.int64)
+            minors = numpy.array([parsed.minor for parsed in parsed_versions],
+                                 dtype=numpy.int64)
+            builds = numpy.array([parsed.build for parsed in parsed_versions],
+                                 dtype=numpy.int64)
+        except OverflowError as overflow_err:
+            raise VersionException('Version part too large for VersionArray',
+                                   ex=overflow_err)
+        # lexsort is stable and sorts on the last key first, negating the keys
+        # gives highest version first while equal versions keep their input order
+        order = numpy.lexsort((-builds, -minors, -majors))
+        self._majors = majors[order]
+        self._minors = minors[order]
+        self._versions = [parsed_versions[i].version for i in order]
+
+    def get_sorted_versions(self):
+        """
+        Returns:
+            array: the valid versions, sorted highest version first
+        """
+        return list(self._versions)
+
+    def best_match(self, semver_string):
+        """
+        Returns the best match for a given semver version
+
+        Args:
+            semver_string: the semver string to process (for instance '~1.2.0')
+
+        Returns:
+            string: the version that best matches the semver string
+
+        Raises:
+            VersionException: on invalid semver_string or if no match was found
+        """
+        match = Version._is_valid_semver(semver_string)
+        if not match:
+            raise VersionException('Semver version under service environment is invalid: "{}"'
+                                   .format(semver_string))
+        mask = self._majors == int(match.group(1))
+        if not Version._semver_max_minor(semver_string):
+            mask &= self._minors == int(match.group(2))
+        if mask.any():
+            return self._versions[int(mask.argmax())]
+        raise VersionException('No image found for requested version "{}"'
+                               .format(semver_string))
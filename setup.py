@@ -19,5 +19,8 @@ setup(
       license='MIT',
       packages=find_packages(exclude=['test']),
       zip_safe=False,
-      install_requires=requirements
+      install_requires=requirements,
+      extras_require={
+            'numpy': ['numpy']
+      }
 )
@@ -3,9 +3,10 @@ __author__ = 'tinglev@kth.se'
 import os
 import json
 import unittest
-from mock import patch
+from mock import patch, MagicMock
 from everest_util.entities.application import Application, ApplicationException
 from everest_util.systems.registry import Registry
+from everest_util.systems.registry_router import RegistryRouter
 import test.entities.test_data as test_data
 import root_path
 from everest_util.json_encoder import ApplicationJsonEncoder
@@ -91,3 +92,39 @@ class ApplicationTests(unittest.TestCase):
     def test_to_string(self):
         app = test_data.get_test_application()
         self.assertEqual(str(app), '(application: "kth-azure-app", cluster: "stage")')
+
+    def test_prefetch_image_tags(self):
+        registry = Registry('', '', '')
+        registry.get_image_tags_many = MagicMock(return_value={'kth-azure-app': ['2.2.1']})
+        app = Application(registry, root_path.get_root_path())
+        app._file_path = ('{}/docker-stack.yml'.format(os.path.dirname(os.path.realpath(__file__))))
+        app._parse_file_contents()
+        services = app._get_stack_services()
+        host = 'kth-docker-registry.sys.kth.se'
+        self.assertEqual(app._get_semver_images(services), [(host, 'kth-azure-app')])
+        self.assertEqual(app._prefetch_image_tags(services),
+                         {(host, 'kth-azure-app'): ['2.2.1']})
+        registry.get_image_tags_many.assert_called_once_with(['kth-azure-app'])
+        self.assertEqual(app._prefetch_image_tags([('redis', {'image': 'redis:1.0'})]), {})
+
+    def test_prefetch_image_tags_per_host(self):
+        kth = Registry('', '', '')
+        kth.get_image_tags_many = MagicMock(return_value={'team/app': ['1.0.0']})
+        default = Registry('', '', '')
+        default.get_image_tags_many = MagicMock(return_value={'redis': ['4.0.0']})
+        app = Application(RegistryRouter(default, {'kth.se:5000': kth}), root_path.get_root_path())
+        services = [('app', {'image': 'kth.se:5000/team/app:${APP_VERSION}'}),
+                    ('redis', {'image': 'redis:${REDIS_VERSION}'}),
+                    ('other', {'image': 'other.com/other:${OTHER_VERSION}'})]
+        image_tags = app._prefetch_image_tags(services)
+        self.assertEqual(image_tags[('kth.se:5000', 'team/app')], ['1.0.0'])
+        self.assertEqual(image_tags[(None, 'redis')], ['4.0.0'])
+        self.assertIsInstance(image_tags[('other.com', 'other')], Exception)
+        kth.get_image_tags_many.assert_called_once_with(['team/app'])
+
+    def test_index_image_tags(self):
+        error = ApplicationException('failed')
+        indexes = Application._index_image_tags({(None, 'app'): ['1.0.0', '1.1.0'],
+                                                 (None, 'missing'): error})
+        self.assertEqual(indexes[(None, 'app')].best_match('^1.0.0'), '1.1.0')
+        self.assertIs(indexes[(None, 'missing')], error)
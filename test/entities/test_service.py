@@ -8,6 +8,9 @@ from everest_util.json_encoder import ApplicationJsonEncoder
 from everest_util.entities.image import Image
 from everest_util.entities.label_list import LabelList
 from everest_util.systems.registry import Registry
+from everest_util.systems.registry_router import RegistryRouter
+from everest_util import version
+from everest_util.version import VersionIndex, VersionArray
 
 class ServiceTests(unittest.TestCase):
 
@@ -49,6 +52,42 @@ class ServiceTests(unittest.TestCase):
         self.assertTrue(service._image.get_is_semver())
         self.assertEqual(service._image.get_version_env_key(), 'WEB_VERSION')
 
+    def test_get_registry_tags(self):
+        registry = Registry('', '', '')
+        registry.get_image_tags = MagicMock(return_value=['1.0.0'])
+        service = Service(registry)
+        service._image.set_name('kth-azure-app')
+        self.assertEqual(service._get_registry_tags(), ['1.0.0'])
+        service._image_tags = {(None, 'kth-azure-app'): ['2.0.0']}
+        self.assertEqual(service._get_registry_tags(), ['2.0.0'])
+        service._image_tags = {(None, 'kth-azure-app'): ServiceException('prefetch failed')}
+        self.assertRaises(ServiceException, service._get_registry_tags)
+        self.assertEqual(registry.get_image_tags.call_count, 1)
+
+    def test_get_registry_tags_with_repository_path(self):
+        registry = Registry('', '', '')
+        registry.get_image_tags = MagicMock(return_value=['1.0.0'])
+        router = RegistryRouter(registries={'kth.se:5000': registry})
+        service = Service(router)
+        service._service_struct = {'image': 'kth.se:5000/team/app:1.0.0'}
+        service._parse_image_info()
+        self.assertEqual(service._image.get_registry(), 'kth.se:5000/team')
+        self.assertEqual(service._get_registry_tags(), ['1.0.0'])
+        registry.get_image_tags.assert_called_once_with('team/app')
+
+    def test_fetch_semver_version_from_version_index(self):
+        registry = Registry('', '', '')
+        registry.get_image_tags = MagicMock()
+        indexes = [VersionIndex(['1.2.0', '1.3.0_abc', '2.0.0'])]
+        if version.numpy is not None:
+            indexes.append(VersionArray(['1.2.0', '1.3.0_abc', '2.0.0']))
+        for index in indexes:
+            service = Service(registry).init_from_stack_service('web', {
+                'image': 'app:${APP_VERSION}', 'environment': {'APP_VERSION': '^1.0.0'},
+                'labels': [], 'deploy': {'labels': []}}, {(None, 'app'): index})
+            self.assertEqual(service.get_image().get_semver_version(), '1.3.0_abc')
+        registry.get_image_tags.assert_not_called()
+
     def test_get_env_value_from_struct(self):
         service = Service(Registry('', '', ''))
         service._service_struct = {'environment': {'WEB_VERSION': '2.0.0'}}
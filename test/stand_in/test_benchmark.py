@@ -0,0 +1,26 @@
+__author__ = 'tinglev@kth.se'
+
+import unittest
+from everest_util.stand_in import benchmark
+
+class BenchmarkTests(unittest.TestCase):
+
+    def test_benchmark_result(self):
+        result = benchmark.BenchmarkResult('test', [0.004, 0.001, 0.002, 0.003], 1, 0.5)
+        self.assertEqual(result.get_percentile(50), 0.003)
+        self.assertEqual(result.get_percentile(99), 0.004)
+        report = result.get_report()
+        self.assertEqual(report['calls'], 5)
+        self.assertEqual(report['throughput'], 10.0)
+        self.assertIn('5 calls, 1 errors', str(result))
+        self.assertIsNone(benchmark.BenchmarkResult('empty', [], 0, 0).get_percentile(50))
+
+    def test_run_registry_benchmark(self):
+        result = benchmark.run_registry_benchmark(calls=20, concurrency=4, images=2,
+                                                  tags_per_image=50, max_page_size=20)
+        self.assertEqual(result.get_report()['calls'], 20)
+        self.assertEqual(result.errors, 0)
+
+    def test_run_slack_benchmark(self):
+        result = benchmark.run_slack_benchmark(calls=10, concurrency=2)
+        self.assertEqual(len(result.latencies), 10)
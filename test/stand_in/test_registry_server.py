@@ -0,0 +1,50 @@
+__author__ = 'tinglev@kth.se'
+
+import unittest
+from everest_util.systems.registry import (Registry, RegistryHTTPException,
+                                           RegistryImageNotFoundException)
+from everest_util.systems.registry_cache import TagCache
+from everest_util.stand_in.registry_server import FakeRegistryServer
+
+class FakeRegistryServerTests(unittest.TestCase):
+
+    def test_generate_tags(self):
+        tags = FakeRegistryServer.generate_tags(250)
+        self.assertEqual(len(tags), 250)
+        self.assertEqual(tags, sorted(tags))
+        self.assertTrue(tags[0].startswith('0.0.0_'))
+        self.assertEqual(len(set(tags)), 250)
+
+    def test_paginated_tags(self):
+        with FakeRegistryServer({'app': 250}, max_page_size=100) as server:
+            registry = Registry('', '', server.get_base_url())
+            self.assertEqual(registry.get_image_tags('app'), server.get_tags('app'))
+            self.assertEqual(server.request_count, 3)
+            self.assertEqual(list(registry.iter_image_tags('app', page_size=60)),
+                             server.get_tags('app'))
+            self.assertEqual(server.request_count, 8)
+            registry.close()
+
+    def test_catalog(self):
+        with FakeRegistryServer({'b': 1, 'a': 1, 'c': 1}, max_page_size=2) as server:
+            registry = Registry('', '', server.get_base_url())
+            self.assertEqual(list(registry.iter_repositories()), ['a', 'b', 'c'])
+            registry.close()
+
+    def test_etag_revalidation(self):
+        with FakeRegistryServer({'app': 10}) as server:
+            tag_cache = TagCache(ttl=0)
+            registry = Registry('', '', server.get_base_url(), tag_cache=tag_cache)
+            self.assertEqual(registry.get_image_tags('app'), server.get_tags('app'))
+            self.assertEqual(registry.get_image_tags('app'), server.get_tags('app'))
+            self.assertEqual(tag_cache.get_stats()['revalidations'], 1)
+            registry.close()
+
+    def test_throttling_and_not_found(self):
+        with FakeRegistryServer({'app': 10}, throttle_every=2, retry_after=0) as server:
+            registry = Registry('', '', server.get_base_url())
+            self.assertRaises(RegistryImageNotFoundException, registry.get_image_tags, 'other')
+            self.assertRaises(RegistryHTTPException, registry.get_image_tags, 'app')
+            registry = Registry('', '', server.get_base_url(), max_retries=1)
+            self.assertEqual(registry.get_image_tags('app'), server.get_tags('app'))
+            registry.close()
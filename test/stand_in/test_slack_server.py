@@ -0,0 +1,49 @@
+__author__ = 'tinglev@kth.se'
+
+import unittest
+import requests
+from everest_util.systems.slack import Slack, SlackHTTPErrorException
+from everest_util.stand_in.slack_server import FakeSlackServer
+
+class FakeSlackServerTests(unittest.TestCase):
+
+    def test_rate_limit_per_channel(self):
+        with FakeSlackServer(rate_limit=1, rate_period=60) as server:
+            slack = Slack(server.get_webhook_url(), max_retries=0)
+            slack.call_slack_endpoint(slack.create_payload_body('#a', 'one', 'user', ':+1:'))
+            slack.call_slack_endpoint(slack.create_payload_body('#b', 'two', 'user', ':+1:'))
+            self.assertRaises(SlackHTTPErrorException, slack.call_slack_endpoint,
+                              slack.create_payload_body('#a', 'three', 'user', ':+1:'))
+            self.assertEqual([payload['text'] for payload in server.received], ['one', 'two'])
+            self.assertEqual(server.throttled, 1)
+
+    def test_retry_after(self):
+        with FakeSlackServer(rate_limit=1, rate_period=60) as server:
+            requests.post(server.get_webhook_url(), json={'channel': '#a'})
+            response = requests.post(server.get_webhook_url(), json={'channel': '#a'})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '60')
+
+    def test_invalid_payload(self):
+        with FakeSlackServer() as server:
+            response = requests.post(server.get_webhook_url(), data='not json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(server.received, [])
+
+    def test_client_rate_limit(self):
+        with FakeSlackServer(rate_limit=1, rate_period=0.1) as server:
+            slack = Slack(server.get_webhook_url(), rate=8, max_retries=0)
+            for i in range(4):
+                slack.call_slack_endpoint(slack.create_payload_body('#a', str(i), 'user', ':+1:'))
+            self.assertEqual(len(server.received), 4)
+            self.assertEqual(server.throttled, 0)
+            slack.close()
+
+    def test_retry_after_backoff(self):
+        with FakeSlackServer(rate_limit=1, rate_period=0.5) as server:
+            slack = Slack(server.get_webhook_url(), rate=100, max_retries=2)
+            for i in range(2):
+                slack.call_slack_endpoint(slack.create_payload_body('#a', str(i), 'user', ':+1:'))
+            self.assertEqual(len(server.received), 2)
+            self.assertEqual(server.throttled, 1)
+            slack.close()
@@ -0,0 +1,67 @@
+__author__ = 'tinglev@kth.se'
+
+import json
+import threading
+import unittest
+import BaseHTTPServer
+from everest_util.systems.async_registry import AsyncRegistry
+from everest_util.systems.registry import RegistryImageException, RegistryHTTPException
+
+class RegistryHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    release = threading.Event()
+
+    def do_GET(self): # pylint: disable=C0103
+        image_name = self.path.split('/')[2]
+        if image_name == 'slow':
+            RegistryHandler.release.wait(5)
+        if image_name == 'missing':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps({'name': image_name, 'tags': ['1.0.0']})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): # pylint: disable=W0221
+        pass
+
+class AsyncRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RegistryHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        RegistryHandler.release.clear()
+
+    def tearDown(self):
+        RegistryHandler.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_image_tags(self):
+        registry = AsyncRegistry('', '', self.base_url, concurrency=2)
+        requests = [registry.get_image_tags(name) for name in ['app', 'missing', 'other']]
+        self.assertEqual(requests[0].result(5), ['1.0.0'])
+        self.assertRaises(RegistryImageException, requests[1].result, 5)
+        self.assertEqual(requests[2].result(5), ['1.0.0'])
+        self.assertTrue(all(request.done() for request in requests))
+        registry.close()
+
+    def test_cancel(self):
+        registry = AsyncRegistry('', '', self.base_url, concurrency=1)
+        slow = registry.get_image_tags('slow')
+        queued = registry.get_image_tags('app')
+        self.assertTrue(queued.cancel())
+        self.assertTrue(queued.cancelled())
+        self.assertRaises(RegistryHTTPException, queued.result, 0)
+        self.assertRaises(RegistryHTTPException, slow.result, 0.01)
+        RegistryHandler.release.set()
+        self.assertEqual(slow.result(5), ['1.0.0'])
+        self.assertFalse(slow.cancel())
+        registry.close()
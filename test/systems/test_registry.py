@@ -1,7 +1,11 @@
 __author__ = 'tinglev@kth.se'
 
+import threading
+import time
 import unittest
 import responses
+from mock import patch
+from everest_util.flow_control import AdaptiveLimiter
 from everest_util.systems.registry import Registry, RegistryImageException, RegistryHTTPException
 
 class GitTests(unittest.TestCase):
@@ -25,3 +29,224 @@ class GitTests(unittest.TestCase):
         tags = registry.get_image_tags('kth-azure-app')
         self.assertEqual(tags, ['2.4.184_bd355c4', '2.4.186_599e682', '2.5.16_6b45aba'])
         self.assertRaises(RegistryHTTPException, registry.get_image_tags, 'kth-azure-app')
+
+    @responses.activate
+    def test_registry_request_timeout(self):
+        registry = Registry('', '', 'https://test.com', timeout=(3, 10))
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200)
+        adapter = registry._sessions.adapter
+        with patch.object(adapter, 'send', wraps=adapter.send) as send:
+            self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+            self.assertEqual(send.call_args[1]['timeout'], (3, 10))
+
+    def test_get_tags_url_paginated(self):
+        registry = Registry('', '', 'https://test.com')
+        self.assertEqual(registry._get_tags_url('app', 50),
+                         'https://test.com/v2/app/tags/list?n=50')
+        self.assertEqual(registry._get_tags_url('app', 50, '1.0.0_abc'),
+                         'https://test.com/v2/app/tags/list?n=50&last=1.0.0_abc')
+
+    @responses.activate
+    def test_iter_image_tags(self):
+        registry = Registry('', '', 'https://test.com')
+        url = 'https://test.com/v2/app/tags/list'
+        responses.add(responses.GET, url, json={'tags': ['1.0.0', '1.0.1']}, status=200,
+                      headers={'Link': '</v2/app/tags/list?n=2&last=1.0.1>; rel="next"'},
+                      match_querystring=False)
+        responses.add(responses.GET, url, json={'tags': ['1.0.2', '1.0.3']}, status=200,
+                      match_querystring=False)
+        responses.add(responses.GET, url, json={'tags': []}, status=200,
+                      match_querystring=False)
+        tags = registry.iter_image_tags('app', page_size=2)
+        self.assertEqual(next(tags), '1.0.0')
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(list(tags), ['1.0.1', '1.0.2', '1.0.3'])
+        self.assertEqual(responses.calls[0].request.url, url + '?n=2')
+        self.assertEqual(responses.calls[1].request.url, url + '?n=2&last=1.0.1')
+        self.assertEqual(responses.calls[2].request.url, url + '?n=2&last=1.0.3')
+
+    @responses.activate
+    def test_iter_image_tags_registry_ignoring_pagination(self):
+        registry = Registry('', '', 'https://test.com')
+        url = 'https://test.com/v2/app/tags/list'
+        all_tags = ['1.0.{}'.format(i) for i in range(150)]
+        responses.add(responses.GET, url, json={'tags': all_tags}, status=200,
+                      match_querystring=False)
+        self.assertEqual(list(registry.iter_image_tags('app', page_size=100)), all_tags)
+        self.assertEqual(len(responses.calls), 1)
+        responses.reset()
+        # Honours n but ignores last, the same page keeps coming back
+        responses.add(responses.GET, url, json={'tags': all_tags[:100]}, status=200,
+                      match_querystring=False)
+        self.assertEqual(list(registry.iter_image_tags('app', page_size=100)), all_tags[:100])
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_iter_repositories_registry_ignoring_last(self):
+        registry = Registry('', '', 'https://test.com')
+        responses.add(responses.GET, 'https://test.com/v2/_catalog',
+                      json={'repositories': ['app', 'web']}, status=200,
+                      match_querystring=False)
+        self.assertEqual(list(registry.iter_repositories(page_size=2)), ['app', 'web'])
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_get_image_tags_follows_link_header(self):
+        registry = Registry('', '', 'https://test.com')
+        url = 'https://test.com/v2/app/tags/list'
+        responses.add(responses.GET, url, json={'tags': ['1.0.0']}, status=200,
+                      headers={'Link': '</v2/app/tags/list?last=1.0.0>; rel="next"'},
+                      match_querystring=False)
+        responses.add(responses.GET, url, json={'tags': ['1.0.1']}, status=200,
+                      match_querystring=False)
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0', '1.0.1'])
+
+    @responses.activate
+    def test_get_image_tags_many(self):
+        registry = Registry('', '', 'https://test.com')
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200)
+        responses.add(responses.GET, 'https://test.com/v2/missing/tags/list',
+                      json={}, status=404)
+        result = registry.get_image_tags_many(['app', 'missing', 'app'], max_workers=2)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(result['app'], ['1.0.0'])
+        self.assertIsInstance(result['missing'], RegistryImageException)
+        self.assertEqual(registry.get_image_tags_many([]), {})
+
+    @responses.activate
+    def test_get_image_tags_coalesces_concurrent_calls(self):
+        registry = Registry('', '', 'https://test.com')
+        def slow_tags(_):
+            time.sleep(0.2)
+            return (200, {}, '{"tags": ["1.0.0"]}')
+        responses.add_callback(responses.GET, 'https://test.com/v2/app/tags/list',
+                               callback=slow_tags)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get_image_tags('app')))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(results, [['1.0.0']] * 4)
+
+    @responses.activate
+    def test_get_image_tags_deadline(self):
+        registry = Registry('', '', 'https://test.com', timeout=30)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200)
+        self.assertRaises(RegistryHTTPException, registry.get_image_tags, 'app', -1)
+        self.assertEqual(len(responses.calls), 0)
+        adapter = registry._sessions.adapter
+        with patch.object(adapter, 'send', wraps=adapter.send) as send:
+            self.assertEqual(registry.get_image_tags('app', deadline=5), ['1.0.0'])
+            self.assertLessEqual(send.call_args[1]['timeout'], 5)
+
+    @responses.activate
+    def test_retry_after(self):
+        limiter = AdaptiveLimiter(initial_limit=4)
+        registry = Registry('', '', 'https://test.com', limiter=limiter, max_retries=1)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      status=429, headers={'Retry-After': '0.1'})
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200)
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(limiter.limit, 2.5)
+        self.assertEqual(limiter.in_flight, 0)
+        responses.replace(responses.GET, 'https://test.com/v2/app/tags/list',
+                          status=503, headers={'Retry-After': '10'})
+        self.assertRaises(RegistryHTTPException, registry.get_image_tags, 'app', 1)
+
+    @responses.activate
+    def test_hedged_request(self):
+        registry = Registry('', '', 'https://test.com', hedge_percentile=95)
+        for _ in range(registry._latencies.min_samples):
+            registry._latencies.add(0.01)
+        delays = [1, 0]
+        slow_done = threading.Event()
+        def tags(_):
+            delay = delays.pop(0)
+            time.sleep(delay)
+            if delay:
+                slow_done.set()
+            return (200, {}, '{"tags": ["1.0.0"]}')
+        responses.add_callback(responses.GET, 'https://test.com/v2/app/tags/list',
+                               callback=tags)
+        started = time.time()
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertLess(time.time() - started, 0.5)
+        self.assertEqual(delays, [])
+        # Let the slow request finish before responses is deactivated
+        slow_done.wait(5)
+        while len(responses.calls) < 2:
+            time.sleep(0.01)
+        registry.close()
+
+    @responses.activate
+    def test_hedged_request_needs_limiter_slot(self):
+        limiter = AdaptiveLimiter(initial_limit=1, max_limit=1)
+        registry = Registry('', '', 'https://test.com', limiter=limiter, hedge_percentile=95)
+        for _ in range(registry._latencies.min_samples):
+            registry._latencies.add(0.01)
+        def slow_tags(_):
+            time.sleep(0.2)
+            return (200, {}, '{"tags": ["1.0.0"]}')
+        responses.add_callback(responses.GET, 'https://test.com/v2/app/tags/list',
+                               callback=slow_tags)
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(limiter.in_flight, 0)
+        registry.close()
+
+    @responses.activate
+    def test_hedged_requests_reuse_sessions(self):
+        registry = Registry('', '', 'https://test.com', pool_size=2, hedge_percentile=95)
+        for _ in range(registry._latencies.min_samples):
+            registry._latencies.add(1)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200)
+        sessions = set()
+        send_request = registry._send_request
+        def record_session(*args):
+            sessions.add(registry._sessions.get())
+            return send_request(*args)
+        with patch.object(registry, '_send_request', side_effect=record_session):
+            for _ in range(10):
+                self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        # The requests run on the threads of the hedge pool, which keep their sessions
+        self.assertLessEqual(len(sessions), 4)
+        registry.close()
+
+    @responses.activate
+    def test_deadline_includes_limiter_wait(self):
+        limiter = AdaptiveLimiter(initial_limit=1, max_limit=1)
+        registry = Registry('', '', 'https://test.com', limiter=limiter, timeout=30)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200)
+        limiter.acquire()
+        threading.Timer(0.3, limiter.release).start()
+        adapter = registry._sessions.adapter
+        with patch.object(adapter, 'send', wraps=adapter.send) as send:
+            self.assertEqual(registry.get_image_tags('app', deadline=1), ['1.0.0'])
+            self.assertLessEqual(send.call_args[1]['timeout'], 0.75)
+
+    @responses.activate
+    def test_coalesced_caller_keeps_its_deadline(self):
+        registry = Registry('', '', 'https://test.com')
+        def slow_tags(_):
+            time.sleep(0.5)
+            return (200, {}, '{"tags": ["1.0.0"]}')
+        responses.add_callback(responses.GET, 'https://test.com/v2/app/tags/list',
+                               callback=slow_tags)
+        leader = threading.Thread(target=registry.get_image_tags, args=('app',))
+        leader.start()
+        while not registry._in_flight.in_flight():
+            time.sleep(0.01)
+        started = time.time()
+        self.assertRaises(RegistryHTTPException, registry.get_image_tags, 'app', 0.1)
+        self.assertLess(time.time() - started, 0.3)
+        leader.join()
@@ -0,0 +1,86 @@
+__author__ = 'tinglev@kth.se'
+
+import unittest
+import responses
+from everest_util.systems.registry import (Registry, RegistryHTTPException,
+                                           RegistryImageNotFoundException)
+from everest_util.systems.registry_cache import TagCache
+from everest_util.systems.registry_auth import BearerTokenCache
+
+CHALLENGE = ('Bearer realm="https://auth.test.com/token",service="test.com",'
+             'scope="repository:app:pull"')
+
+class RegistryAuthTests(unittest.TestCase):
+
+    def test_parse_challenge(self):
+        self.assertEqual(BearerTokenCache.parse_challenge(CHALLENGE),
+                         {'realm': 'https://auth.test.com/token', 'service': 'test.com',
+                          'scope': 'repository:app:pull'})
+        self.assertIsNone(BearerTokenCache.parse_challenge('Basic realm="test"'))
+        self.assertIsNone(BearerTokenCache.parse_challenge(None))
+
+    def test_token_cache(self):
+        tokens = BearerTokenCache()
+        tokens.set('repository:app:pull', 'abc', 300)
+        tokens.set('repository:old:pull', 'def', 1)
+        self.assertEqual(tokens.get('repository:app:pull'), 'abc')
+        self.assertIsNone(tokens.get('repository:old:pull'))
+        self.assertIsNone(tokens.get('repository:other:pull'))
+
+    @responses.activate
+    def test_bearer_flow(self):
+        registry = Registry('user', 'pass', 'https://test.com')
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      status=401, headers={'WWW-Authenticate': CHALLENGE})
+        responses.add(responses.GET, 'https://auth.test.com/token',
+                      json={'token': 'abc', 'expires_in': 300}, status=200,
+                      match_querystring=False)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200)
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(len(responses.calls), 3)
+        self.assertIn('scope=repository%3Aapp%3Apull', responses.calls[1].request.url)
+        self.assertEqual(responses.calls[2].request.headers['Authorization'], 'Bearer abc')
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(len(responses.calls), 4)
+        self.assertEqual(responses.calls[3].request.headers['Authorization'], 'Bearer abc')
+
+    @responses.activate
+    def test_bearer_flow_with_other_challenge_scope(self):
+        registry = Registry('user', 'pass', 'https://test.com')
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      status=401, headers={'WWW-Authenticate': CHALLENGE.replace(
+                          'app:pull', 'app:pull,push')})
+        responses.add(responses.GET, 'https://auth.test.com/token',
+                      json={'token': 'abc', 'expires_in': 300}, status=200,
+                      match_querystring=False)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200)
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(len(responses.calls), 4)
+        self.assertEqual(responses.calls[3].request.headers['Authorization'], 'Bearer abc')
+
+    @responses.activate
+    def test_bearer_flow_with_failing_token_server(self):
+        tag_cache = TagCache(negative_ttl=60)
+        registry = Registry('user', 'pass', 'https://test.com', tag_cache=tag_cache)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      status=401, headers={'WWW-Authenticate': CHALLENGE})
+        responses.add(responses.GET, 'https://auth.test.com/token', status=404,
+                      match_querystring=False)
+        with self.assertRaises(RegistryHTTPException) as context:
+            registry.get_image_tags('app')
+        self.assertNotIsInstance(context.exception, RegistryImageNotFoundException)
+        self.assertIn('https://auth.test.com/token', str(context.exception))
+        self.assertIsNone(tag_cache.get_missing('app'))
+
+    @responses.activate
+    def test_bearer_flow_without_token(self):
+        registry = Registry('user', 'pass', 'https://test.com')
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      status=401, headers={'WWW-Authenticate': CHALLENGE})
+        responses.add(responses.GET, 'https://auth.test.com/token',
+                      json={}, status=200, match_querystring=False)
+        self.assertRaises(RegistryHTTPException, registry.get_image_tags, 'app')
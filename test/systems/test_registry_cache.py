@@ -0,0 +1,207 @@
+__author__ = 'tinglev@kth.se'
+
+import os
+import time
+import errno
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import multiprocessing
+import responses
+from mock import patch
+from everest_util.systems.registry import (Registry, RegistryImageNotFoundException,
+                                           RegistryCacheException)
+from everest_util.systems.registry_cache import TagCache, DiskTagCache
+
+def write_to_disk_cache(directory, index):
+    disk_cache = DiskTagCache(directory)
+    for number in range(20):
+        TagCache(disk_cache=disk_cache).set('app{}'.format(index), [str(number)])
+
+class RegistryCacheTests(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = TagCache(ttl=60, max_size=2)
+        cache.set('a', ['1.0.0'])
+        cache.set('b', ['1.0.0'])
+        cache.get('a')
+        cache.set('c', ['1.0.0'])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a').tags, ['1.0.0'])
+
+    def test_is_fresh(self):
+        cache = TagCache(ttl=60)
+        entry = cache.set('a', ['1.0.0'])
+        self.assertTrue(cache.is_fresh(entry))
+        entry.fetched_at -= 61
+        self.assertFalse(cache.is_fresh(entry))
+        cache.refresh('a', entry)
+        self.assertTrue(cache.is_fresh(entry))
+
+    @responses.activate
+    def test_get_image_tags_from_cache(self):
+        cache = TagCache(ttl=60)
+        registry = Registry('', '', 'https://test.com', tag_cache=cache)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200, headers={'ETag': '"v1"'})
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(cache.get_stats(), dict(hits=1, stale_hits=0, negative_hits=0,
+                                                 misses=1, revalidations=0, size=1))
+
+    @responses.activate
+    def test_get_image_tags_revalidation(self):
+        cache = TagCache(ttl=0)
+        registry = Registry('', '', 'https://test.com', tag_cache=cache)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200, headers={'ETag': '"v1"'})
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      body='', status=304)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0', '1.0.1']}, status=200, headers={'ETag': '"v2"'})
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(responses.calls[1].request.headers['If-None-Match'], '"v1"')
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0', '1.0.1'])
+        self.assertEqual(cache.get('app').etag, '"v2"')
+        self.assertEqual(cache.get_stats(), dict(hits=0, stale_hits=0, negative_hits=0,
+                                                 misses=2, revalidations=1, size=1))
+
+    @responses.activate
+    def test_negative_cache(self):
+        cache = TagCache(ttl=60, negative_ttl=60)
+        registry = Registry('', '', 'https://test.com', tag_cache=cache)
+        responses.add(responses.GET, 'https://test.com/v2/missing/tags/list',
+                      json={}, status=404)
+        self.assertRaises(RegistryImageNotFoundException, registry.get_image_tags, 'missing')
+        self.assertRaises(RegistryImageNotFoundException, registry.get_image_tags, 'missing')
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(cache.get_stats()['negative_hits'], 1)
+        cache._missing['missing'] = (cache._missing['missing'][0], time.time() - 61)
+        self.assertRaises(RegistryImageNotFoundException, registry.get_image_tags, 'missing')
+        self.assertEqual(len(responses.calls), 2)
+        cache.set('missing', ['1.0.0'])
+        self.assertIsNone(cache.get_missing('missing'))
+
+    @responses.activate
+    def test_stale_while_revalidate(self):
+        cache = TagCache(ttl=60, stale_while_revalidate=60)
+        registry = Registry('', '', 'https://test.com', tag_cache=cache)
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.1']}, status=200)
+        entry = cache.set('app', ['1.0.0'])
+        entry.fetched_at -= 90
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+        for _ in range(100):
+            if cache.get('app').tags == ['1.0.1']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.1'])
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(cache.get_stats()['stale_hits'], 1)
+        cache.get('app').fetched_at -= 150
+        self.assertEqual(registry.get_image_tags('app'), ['1.0.1'])
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_warm_cache(self):
+        cache = TagCache(ttl=60)
+        registry = Registry('', '', 'https://test.com', tag_cache=cache)
+        responses.add(responses.GET, 'https://test.com/v2/_catalog',
+                      json={'repositories': ['kth-app', 'kth-web']}, status=200,
+                      headers={'Link': '</v2/_catalog?n=2&last=kth-web>; rel="next"'},
+                      match_querystring=False)
+        responses.add(responses.GET, 'https://test.com/v2/_catalog',
+                      json={'repositories': ['redis', 'kth-gone']}, status=200,
+                      match_querystring=False)
+        for name in ['kth-app', 'kth-web']:
+            responses.add(responses.GET, 'https://test.com/v2/{}/tags/list'.format(name),
+                          json={'tags': ['1.0.0']}, status=200)
+        responses.add(responses.GET, 'https://test.com/v2/kth-gone/tags/list',
+                      json={}, status=404)
+        progress = []
+        result = registry.warm_cache('kth-*', max_workers=2,
+                                     progress_callback=lambda *args: progress.append(args))
+        self.assertEqual(result['repositories'], 3)
+        self.assertEqual(result['failed'], 1)
+        self.assertEqual(progress[-1], (3, 3))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(registry.get_image_tags('kth-web'), ['1.0.0'])
+        self.assertEqual(cache.get_stats()['hits'], 1)
+        self.assertRaises(RegistryCacheException, Registry('', '', '').warm_cache)
+
+class DiskTagCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_set_and_get(self):
+        disk_cache = DiskTagCache(self.directory, namespace='https://test.com')
+        cache = TagCache(ttl=60, disk_cache=disk_cache)
+        entry = cache.set('app', ['1.0.0', '1.0.1'], '"v1"')
+        restarted = TagCache(ttl=60, disk_cache=DiskTagCache(self.directory,
+                                                             namespace='https://test.com'))
+        loaded = restarted.get('app')
+        self.assertEqual(loaded.tags, ['1.0.0', '1.0.1'])
+        self.assertEqual(loaded.etag, '"v1"')
+        self.assertEqual(loaded.fetched_at, entry.fetched_at)
+        self.assertIsNone(DiskTagCache(self.directory, namespace='other').get('app'))
+        disk_cache.clear()
+        self.assertIsNone(disk_cache.get('app'))
+
+    def test_clear_empties_disk_cache(self):
+        cache = TagCache(ttl=60, disk_cache=DiskTagCache(self.directory))
+        cache.set('app', ['1.0.0'])
+        cache.clear()
+        self.assertIsNone(cache.get('app'))
+        self.assertIsNone(DiskTagCache(self.directory).get('app'))
+
+    def test_directory_created_concurrently(self):
+        directory = os.path.join(self.directory, 'cache')
+        DiskTagCache(directory).set('app', TagCache().set('app', ['1.0.0'], None))
+        with patch('os.makedirs', side_effect=OSError(errno.EEXIST, 'File exists')):
+            self.assertEqual(DiskTagCache(directory).get('app').tags, ['1.0.0'])
+        with patch('os.makedirs', side_effect=OSError(errno.EACCES, 'Permission denied')):
+            self.assertRaises(OSError, DiskTagCache, directory)
+
+    def test_clear_logs_database_errors(self):
+        disk_cache = DiskTagCache(self.directory)
+        with patch.object(disk_cache, '_get_connection',
+                          side_effect=sqlite3.OperationalError('database is locked')):
+            with patch.object(disk_cache.log, 'warning') as warning:
+                disk_cache.clear()
+        self.assertEqual(warning.call_count, 1)
+
+    @responses.activate
+    def test_restart_revalidates_from_disk(self):
+        registry = Registry('', '', 'https://test.com',
+                            tag_cache=TagCache(ttl=0, disk_cache=DiskTagCache(self.directory)))
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      json={'tags': ['1.0.0']}, status=200, headers={'ETag': '"v1"'})
+        responses.add(responses.GET, 'https://test.com/v2/app/tags/list',
+                      body='', status=304)
+        registry.get_image_tags('app')
+        restarted = Registry('', '', 'https://test.com',
+                             tag_cache=TagCache(ttl=0, disk_cache=DiskTagCache(self.directory)))
+        self.assertEqual(restarted.get_image_tags('app'), ['1.0.0'])
+        self.assertEqual(responses.calls[1].request.headers['If-None-Match'], '"v1"')
+        self.assertEqual(restarted.tag_cache.get_stats()['revalidations'], 1)
+
+    def test_shared_between_processes(self):
+        processes = [multiprocessing.Process(target=write_to_disk_cache,
+                                             args=(self.directory, index))
+                     for index in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        disk_cache = DiskTagCache(self.directory)
+        for index in range(4):
+            self.assertEqual(disk_cache.get('app{}'.format(index)).tags, ['19'])
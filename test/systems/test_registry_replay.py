@@ -0,0 +1,90 @@
+__author__ = 'tinglev@kth.se'
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import mock
+from everest_util.systems.registry import Registry, RegistryHTTPException
+from everest_util.systems.registry_cache import TagCache
+from everest_util.systems.registry_replay import (ResponseRecording, RecordingAdapter,
+                                                  ReplayAdapter, RegistryReplayException)
+from everest_util.stand_in.registry_server import FakeRegistryServer
+
+class RegistryReplayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'registry.jsonl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def record(self, server, tag_cache=None):
+        adapter = RecordingAdapter()
+        registry = Registry('', '', server.get_base_url(), tag_cache=tag_cache,
+                            transport=adapter)
+        tags = registry.get_image_tags('app')
+        tags_again = registry.get_image_tags('app')
+        self.assertEqual(tags, tags_again)
+        adapter.recording.save(self.path)
+        return tags
+
+    def test_record_and_replay(self):
+        with FakeRegistryServer({'app': 250}, max_page_size=100, latency=0.01) as server:
+            base_url = server.get_base_url()
+            tags = self.record(server)
+        recording = ResponseRecording.load(self.path)
+        records = recording.get_records()
+        self.assertEqual(len(records), 6)
+        self.assertEqual(records[0]['status'], 200)
+        self.assertTrue(records[0]['elapsed'] >= 0.01)
+        self.assertIn('Link', records[0]['headers'])
+        adapter = ReplayAdapter(recording)
+        registry = Registry('', '', base_url, transport=adapter)
+        self.assertEqual(registry.get_image_tags('app'), tags)
+        self.assertEqual(adapter.replayed, 3)
+        self.assertRaises(RegistryHTTPException, registry.get_image_tags, 'other')
+
+    def test_replay_conditional_requests(self):
+        with FakeRegistryServer({'app': 10}) as server:
+            base_url = server.get_base_url()
+            tags = self.record(server, TagCache(ttl=0))
+        recording = ResponseRecording.load(self.path)
+        self.assertEqual([record['status'] for record in recording.get_records()], [200, 304])
+        tag_cache = TagCache(ttl=0)
+        registry = Registry('', '', base_url, tag_cache=tag_cache,
+                            transport=ReplayAdapter(recording))
+        self.assertEqual(registry.get_image_tags('app'), tags)
+        self.assertEqual(registry.get_image_tags('app'), tags)
+        self.assertEqual(tag_cache.get_stats()['revalidations'], 1)
+
+    def test_replay_latency(self):
+        recording = ResponseRecording([{'method': 'GET', 'url': 'https://r.com/v2/app/tags/list',
+                                        'etag': None, 'status': 200, 'elapsed': 0.05,
+                                        'headers': {'Content-Type': 'application/json'},
+                                        'body': '{"tags":["1.0.0"]}'}])
+        for latency, minimum in ((None, 0), ('recorded', 0.05), (0.1, 0.1)):
+            registry = Registry('', '', 'https://r.com',
+                                transport=ReplayAdapter(recording, latency))
+            started = time.time()
+            self.assertEqual(registry.get_image_tags('app'), ['1.0.0'])
+            self.assertTrue(time.time() - started >= minimum)
+
+    def test_record_redacts_tokens(self):
+        request = mock.Mock(method='GET', url='https://auth.r.com/token?scope=x', headers={})
+        response = mock.Mock(status_code=200, content='{"token":"secret","expires_in":300}',
+                             headers={'Content-Type': 'application/json',
+                                      'Set-Cookie': 'session=secret'})
+        record = ResponseRecording.create_record(request, response, 0.01)
+        self.assertEqual(json.loads(record['body']),
+                         {'token': ResponseRecording.REDACTED, 'expires_in': 300})
+        self.assertEqual(record['headers'], {'Content-Type': 'application/json'})
+        response.content = '{"tags":["1.0.0"]}'
+        record = ResponseRecording.create_record(request, response, 0.01)
+        self.assertEqual(record['body'], '{"tags":["1.0.0"]}')
+
+    def test_load_missing_file(self):
+        self.assertRaises(RegistryReplayException, ResponseRecording.load, self.path)
@@ -0,0 +1,40 @@
+__author__ = 'tinglev@kth.se'
+
+import unittest
+import responses
+from everest_util.entities.service import Service
+from everest_util.systems.registry import Registry
+from everest_util.systems.registry_router import RegistryRouter, RegistryRouterException
+
+class RegistryRouterTests(unittest.TestCase):
+
+    def test_get_registry(self):
+        default = Registry('', '', 'https://default.com')
+        kth = Registry('', '', 'https://kth.se')
+        router = RegistryRouter(default, {'kth.se': kth},
+                                lambda host: Registry('', '', 'https://{}'.format(host)))
+        self.assertIs(router.get_registry(None), default)
+        self.assertIs(router.get_registry('kth.se'), kth)
+        other = router.get_registry('other.com')
+        self.assertEqual(other.base_url, 'https://other.com')
+        self.assertIs(router.get_registry('other.com'), other)
+        self.assertEqual(sorted(router.get_hosts()), ['kth.se', 'other.com'])
+        self.assertRaises(RegistryRouterException, RegistryRouter().get_registry, 'kth.se')
+        self.assertRaises(RegistryRouterException, RegistryRouter().get_registry, None)
+
+    @responses.activate
+    def test_service_uses_registry_of_image_host(self):
+        router = RegistryRouter(Registry('', '', 'https://default.com'),
+                                {'kth.se': Registry('', '', 'https://kth.se')})
+        responses.add(responses.GET, 'https://kth.se/v2/app/tags/list',
+                      json={'tags': ['1.2.0', '1.3.0']}, status=200)
+        responses.add(responses.GET, 'https://default.com/v2/redis/tags/list',
+                      json={'tags': ['4.0.1']}, status=200)
+        service = Service(router).init_from_stack_service('web', {
+            'image': 'kth.se/app:${APP_VERSION}', 'environment': {'APP_VERSION': '^1.0.0'},
+            'labels': [], 'deploy': {'labels': []}})
+        self.assertEqual(service.get_image().get_semver_version(), '1.3.0')
+        service = Service(router).init_from_stack_service('redis', {
+            'image': 'redis:${REDIS_VERSION}', 'environment': {'REDIS_VERSION': '~4.0.0'},
+            'labels': [], 'deploy': {'labels': []}})
+        self.assertEqual(service.get_image().get_semver_version(), '4.0.1')
@@ -0,0 +1,22 @@
+__author__ = 'tinglev@kth.se'
+
+import threading
+import unittest
+from requests.adapters import HTTPAdapter
+from everest_util.systems.session_pool import SessionPool
+
+class SessionPoolTests(unittest.TestCase):
+
+    def test_get(self):
+        sessions = SessionPool(HTTPAdapter(pool_maxsize=4))
+        session = sessions.get()
+        self.assertIs(sessions.get(), session)
+        self.assertIs(session.get_adapter('https://test.com'), sessions.adapter)
+        self.assertIs(session.get_adapter('http://test.com'), sessions.adapter)
+        other_sessions = []
+        thread = threading.Thread(target=lambda: other_sessions.append(sessions.get()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other_sessions[0], session)
+        self.assertIs(other_sessions[0].get_adapter('https://test.com'), sessions.adapter)
+        sessions.close()
@@ -1,5 +1,7 @@
 __author__ = 'tinglev@kth.se'
 
+import json
+import time
 import unittest
 import responses
 from everest_util.systems.slack import Slack, SlackHTTPErrorException
@@ -39,3 +41,78 @@ class SlackTests(unittest.TestCase):
         self.assertEqual(slack.call_slack_endpoint({'payload': 'payload'}).status_code, 200)
         self.assertRaises(SlackHTTPErrorException, slack.call_slack_endpoint,
                           {'payload': 'payload'})
+
+    def test_create_payload_bodies(self):
+        slack = Slack('https://test.com/webhook')
+        attachments = [{'text': str(i)} for i in range(45)]
+        bodies = slack.create_payload_bodies('#channel', 'text', 'username', ':+1:',
+                                             attachments)
+        self.assertEqual([len(body['attachments']) for body in bodies], [20, 20, 5])
+        self.assertEqual(bodies[2]['attachments'][-1], {'text': '44'})
+        self.assertEqual(len(slack.create_payload_bodies('#c', 't', 'u', ':+1:', [])), 1)
+
+    @responses.activate
+    def test_retry_on_429(self):
+        slack = Slack('https://test.com/webhook', max_retries=1)
+        responses.add(responses.POST, 'https://test.com/webhook', status=429,
+                      headers={'Retry-After': '0.01'})
+        responses.add(responses.POST, 'https://test.com/webhook', status=200)
+        self.assertEqual(slack.call_slack_endpoint({}).status_code, 200)
+        self.assertEqual(len(responses.calls), 2)
+        responses.reset()
+        responses.add(responses.POST, 'https://test.com/webhook', status=429,
+                      headers={'Retry-After': '0.01'})
+        self.assertRaises(SlackHTTPErrorException, slack.call_slack_endpoint, {})
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_retry_after_is_capped(self):
+        responses.add(responses.POST, 'https://test.com/webhook', status=429,
+                      headers={'Retry-After': '3600'})
+        slack = Slack('https://test.com/webhook', max_retries=0)
+        self.assertRaises(SlackHTTPErrorException, slack.call_slack_endpoint, {})
+        self.assertEqual(len(responses.calls), 1)
+        slack = Slack('https://test.com/webhook', max_retries=1, max_retry_after=0.01)
+        started = time.time()
+        self.assertRaises(SlackHTTPErrorException, slack.call_slack_endpoint, {})
+        self.assertTrue(time.time() - started < 1)
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_rate_limiter_is_shared_per_webhook(self):
+        first = Slack('https://test.com/limited', rate=20)
+        second = Slack('https://test.com/limited', rate=20)
+        self.assertIs(first.rate_limiter, second.rate_limiter)
+        self.assertIsNot(Slack('https://test.com/limited', rate=1).rate_limiter,
+                         first.rate_limiter)
+        self.assertIsNot(Slack('https://test.com/limited', rate=20, burst=5).rate_limiter,
+                         first.rate_limiter)
+        self.assertIsNone(Slack('https://test.com/limited').rate_limiter)
+        responses.add(responses.POST, 'https://test.com/limited', status=200)
+        started = time.time()
+        for _ in range(3):
+            first.call_slack_endpoint({})
+        self.assertTrue(time.time() - started >= 0.09)
+
+    @responses.activate
+    def test_dedup(self):
+        slack = Slack('https://test.com/webhook', dedup_window=60)
+        responses.add(responses.POST, 'https://test.com/webhook', status=200)
+        failing = slack.create_payload_body('#a', 'deploy failed', 'username', ':+1:')
+        for _ in range(3):
+            slack.call_slack_endpoint(failing)
+        self.assertIsNone(slack.call_slack_endpoint(dict(failing)))
+        slack.call_slack_endpoint(slack.create_payload_body('#b', 'other', 'username', ':+1:'))
+        slack.call_slack_endpoint(slack.create_payload_body('#a', 'fixed', 'username', ':+1:'))
+        texts = [json.loads(call.request.body)['text'] for call in responses.calls]
+        self.assertEqual(texts, ['deploy failed', 'other',
+                                 'fixed (3 identical messages suppressed)'])
+        self.assertEqual(failing['text'], 'deploy failed')
+
+    @responses.activate
+    def test_dedup_lets_failed_payload_through_again(self):
+        slack = Slack('https://test.com/webhook', dedup_window=60)
+        responses.add(responses.POST, 'https://test.com/webhook', status=500)
+        responses.add(responses.POST, 'https://test.com/webhook', status=200)
+        self.assertRaises(SlackHTTPErrorException, slack.call_slack_endpoint, {'text': 'a'})
+        self.assertEqual(slack.call_slack_endpoint({'text': 'a'}).status_code, 200)
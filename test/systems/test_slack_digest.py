@@ -0,0 +1,52 @@
+__author__ = 'tinglev@kth.se'
+
+import time
+import unittest
+from everest_util.systems.slack import Slack
+from everest_util.systems.slack_digest import SlackDigest
+
+class SlackDigestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.slack = Slack('https://test.com/webhook')
+
+    def create_digest(self, **digest_args):
+        return SlackDigest(self.slack, 'everest', ':+1:', send=self.sent.append, **digest_args)
+
+    def test_split_on_size(self):
+        digest = self.create_digest(window=None, max_size=45)
+        for i in range(50):
+            digest.add('#deploys', {'text': str(i)})
+        self.assertEqual([len(payload['attachments']) for payload in self.sent], [20, 20, 5])
+        self.assertEqual(self.sent[0]['text'], '45 notifications (1/3)')
+        self.assertEqual(self.sent[0]['channel'], '#deploys')
+        self.assertEqual(digest.get_pending('#deploys'), 5)
+        self.assertEqual(digest.flush(), 1)
+        self.assertEqual(self.sent[-1]['text'], '5 notifications')
+        self.assertEqual(digest.payloads, 4)
+        self.assertEqual(digest.notifications, 50)
+
+    def test_channels_are_separate(self):
+        digest = self.create_digest(window=None)
+        digest.add('#a', {'text': 'a1'})
+        digest.add('#b', {'text': 'b1'})
+        digest.add('#a', {'text': 'a2'})
+        self.assertEqual(digest.flush('#a'), 1)
+        self.assertEqual(self.sent[0]['attachments'], [{'text': 'a1'}, {'text': 'a2'}])
+        digest.close()
+        self.assertEqual(self.sent[1]['channel'], '#b')
+        self.assertEqual(digest.flush(), 0)
+
+    def test_send_on_time_window(self):
+        digest = self.create_digest(window=0.05)
+        digest.add('#a', {'text': 'a1'})
+        digest.add('#a', {'text': 'a2'})
+        self.assertEqual(self.sent, [])
+        for _ in range(100):
+            if self.sent:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(self.sent[0]['attachments']), 2)
+        self.assertEqual(digest.get_pending('#a'), 0)
@@ -0,0 +1,86 @@
+__author__ = 'tinglev@kth.se'
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from everest_util.systems.slack import Slack, SlackHTTPErrorException
+from everest_util.systems.slack_outbox import SlackOutbox
+
+class SlackOutboxTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'outbox.jsonl')
+        self.sent = []
+        self.fail_on = None
+        self.slack = Slack('https://test.com/webhook')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def send(self, payload):
+        if payload == self.fail_on:
+            raise SlackHTTPErrorException('HTTP error when calling Slack')
+        self.sent.append(payload)
+
+    def create_outbox(self, **outbox_args):
+        return SlackOutbox(self.slack, self.path, send=self.send, **outbox_args)
+
+    def test_put_and_drain_in_batches(self):
+        outbox = self.create_outbox(batch_size=3)
+        for i in range(7):
+            outbox.put({'text': i})
+        self.assertFalse(outbox.is_empty())
+        self.assertEqual(outbox.drain(max_batches=2), 6)
+        self.assertEqual(outbox.count_pending(), 1)
+        self.assertEqual(outbox.drain(), 1)
+        self.assertEqual([payload['text'] for payload in self.sent], range(7))
+        self.assertTrue(outbox.is_empty())
+        self.assertEqual(os.path.getsize(self.path), 0)
+        outbox.close()
+
+    def test_resume_after_restart(self):
+        outbox = self.create_outbox(batch_size=2)
+        for i in range(5):
+            outbox.put(i)
+        outbox.drain(max_batches=1)
+        # Simulate a crash: the file is left open and not drained
+        outbox = self.create_outbox(batch_size=2)
+        outbox.put(5)
+        outbox.drain()
+        self.assertEqual(self.sent, range(6))
+        outbox.close()
+
+    def test_failed_delivery_is_retried(self):
+        outbox = self.create_outbox()
+        for i in range(4):
+            outbox.put(i)
+        self.fail_on = 2
+        self.assertEqual(outbox.drain(), 2)
+        self.assertEqual(outbox.failed, 1)
+        self.fail_on = None
+        outbox.close()
+        self.assertEqual(self.sent, [0, 1, 2, 3])
+
+    def test_partial_and_corrupt_lines(self):
+        with open(self.path, 'wb') as outbox_file:
+            outbox_file.write('1\nnot json\n2\n{"text": "half wri')
+        outbox = self.create_outbox()
+        outbox.put(3)
+        outbox.drain()
+        self.assertEqual(self.sent, [1, 2, 3])
+        outbox.close()
+
+    def test_background_drainer(self):
+        outbox = self.create_outbox().start(interval=5)
+        outbox.put('a')
+        for _ in range(100):
+            if self.sent:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.sent, ['a'])
+        outbox.put('b')
+        outbox.close(5)
+        self.assertEqual(self.sent, ['a', 'b'])
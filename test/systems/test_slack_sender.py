@@ -0,0 +1,126 @@
+__author__ = 'tinglev@kth.se'
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import mock
+from everest_util.systems.slack import SlackHTTPErrorException
+from everest_util.systems.slack_sender import BackgroundSlackSender, SlackSenderException
+
+class BackgroundSlackSenderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.slack = mock.Mock()
+        self.slack.call_slack_endpoint.side_effect = self.call_slack_endpoint
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.release.set()
+        shutil.rmtree(self.temp_dir)
+
+    def call_slack_endpoint(self, payload):
+        self.started.set()
+        self.release.wait()
+        self.sent.append(payload)
+
+    def create_blocked_sender(self, **sender_args):
+        """
+        Creates a sender with its worker stuck sending payload 0
+        """
+        self.release.clear()
+        sender = BackgroundSlackSender(self.slack, **sender_args)
+        sender.send(0)
+        self.started.wait(5)
+        return sender
+
+    def test_send_and_flush(self):
+        with BackgroundSlackSender(self.slack) as sender:
+            for i in range(10):
+                self.assertTrue(sender.send({'text': i}))
+            self.assertTrue(sender.flush(5))
+            self.assertEqual([payload['text'] for payload in self.sent], range(10))
+            self.assertEqual(sender.get_stats()['sent'], 10)
+        self.assertRaises(SlackSenderException, sender.send, {})
+
+    def test_drop_oldest(self):
+        sender = self.create_blocked_sender(max_queue_size=2)
+        for i in range(1, 5):
+            self.assertTrue(sender.send(i))
+        self.assertFalse(sender.flush(0.05))
+        self.release.set()
+        self.assertTrue(sender.close(5))
+        self.assertEqual(self.sent, [0, 3, 4])
+        self.assertEqual(sender.get_stats()['dropped'], 2)
+
+    def test_block(self):
+        sender = self.create_blocked_sender(max_queue_size=1, overflow='block')
+        self.assertTrue(sender.send(1))
+        self.assertFalse(sender.send(2, timeout=0.05))
+        threading.Timer(0.05, self.release.set).start()
+        self.assertTrue(sender.send(3, timeout=5))
+        self.assertTrue(sender.close(5))
+        self.assertEqual(self.sent, [0, 1, 3])
+
+    def test_spill(self):
+        spill_path = os.path.join(self.temp_dir, 'spill.jsonl')
+        sender = self.create_blocked_sender(max_queue_size=2, overflow='spill',
+                                            spill_path=spill_path)
+        for i in range(1, 8):
+            self.assertTrue(sender.send(i))
+        self.assertEqual(sender.get_stats()['spilled'], 5)
+        self.release.set()
+        self.assertTrue(sender.close(5))
+        self.assertEqual(self.sent, range(8))
+        self.assertEqual(os.path.getsize(spill_path), 0)
+
+    def test_spill_left_by_previous_sender(self):
+        spill_path = os.path.join(self.temp_dir, 'spill.jsonl')
+        with open(spill_path, 'w') as spill_file:
+            spill_file.write('{"text":"a"}\n{"text":"b"}\n')
+        sender = BackgroundSlackSender(self.slack, overflow='spill', spill_path=spill_path)
+        self.assertTrue(sender.close(5))
+        self.assertEqual(self.sent, [{'text': 'a'}, {'text': 'b'}])
+
+    def test_spill_resumes_after_delivered_offset(self):
+        spill_path = os.path.join(self.temp_dir, 'spill.jsonl')
+        with open(spill_path, 'w') as spill_file:
+            spill_file.write('{"text":"a"}\n{"text":"b"}\n')
+        with open('{}.offset'.format(spill_path), 'w') as offset_file:
+            offset_file.write('13')
+        sender = BackgroundSlackSender(self.slack, overflow='spill', spill_path=spill_path)
+        self.assertTrue(sender.close(5))
+        self.assertEqual(self.sent, [{'text': 'b'}])
+
+    def test_spilled_failures_are_counted(self):
+        spill_path = os.path.join(self.temp_dir, 'spill.jsonl')
+        self.slack.call_slack_endpoint.side_effect = [None, SlackHTTPErrorException('429'), None]
+        sender = BackgroundSlackSender(self.slack, max_queue_size=1, overflow='spill',
+                                       spill_path=spill_path)
+        with sender._condition:
+            for i in range(3):
+                sender.send(i)
+        self.assertTrue(sender.close(5))
+        self.assertEqual(sender.get_stats()['failed'], 1)
+        self.assertEqual(sender.get_stats()['sent'], 2)
+        self.assertEqual(self.slack.call_slack_endpoint.call_count, 3)
+
+    def test_failures_are_counted(self):
+        self.slack.call_slack_endpoint.side_effect = [SlackHTTPErrorException('429'), None]
+        with BackgroundSlackSender(self.slack) as sender:
+            sender.send(1)
+            sender.send(2)
+            self.assertTrue(sender.flush(5))
+            self.assertEqual(sender.get_stats()['failed'], 1)
+            self.assertEqual(sender.get_stats()['sent'], 1)
+
+    def test_invalid_configuration(self):
+        self.assertRaises(SlackSenderException, BackgroundSlackSender, self.slack,
+                          overflow='unknown')
+        self.assertRaises(SlackSenderException, BackgroundSlackSender, self.slack,
+                          overflow='spill')
@@ -0,0 +1,91 @@
+__author__ = 'tinglev@kth.se'
+
+import time
+import unittest
+from everest_util.flow_control import (AdaptiveLimiter, LatencyTracker, TokenBucket,
+                                       DuplicateFilter)
+
+class FlowControlTests(unittest.TestCase):
+
+    def test_limiter_acquire(self):
+        limiter = AdaptiveLimiter(initial_limit=2)
+        self.assertTrue(limiter.acquire(0))
+        self.assertTrue(limiter.acquire(0))
+        self.assertFalse(limiter.acquire(0.01))
+        limiter.release()
+        self.assertTrue(limiter.acquire(0))
+        self.assertEqual(limiter.in_flight, 2)
+
+    def test_limiter_aimd(self):
+        limiter = AdaptiveLimiter(initial_limit=4, min_limit=1, max_limit=5)
+        limiter.acquire()
+        limiter.release()
+        self.assertEqual(limiter.limit, 4.25)
+        limiter.acquire()
+        limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 2.125)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 1)
+        for _ in range(100):
+            limiter.acquire()
+            limiter.release()
+        self.assertEqual(limiter.limit, 5)
+
+    def test_limiter_retry_after(self):
+        limiter = AdaptiveLimiter(initial_limit=4)
+        limiter.acquire()
+        limiter.release(overloaded=True, retry_after=0.2)
+        self.assertFalse(limiter.acquire(0.05))
+        started = time.time()
+        self.assertTrue(limiter.acquire(1))
+        self.assertGreater(time.time() - started, 0.1)
+
+    def test_latency_tracker(self):
+        tracker = LatencyTracker(size=100, min_samples=10)
+        for latency in range(9):
+            tracker.add(latency)
+        self.assertIsNone(tracker.get_percentile(95))
+        for latency in range(9, 200):
+            tracker.add(latency)
+        self.assertEqual(tracker.get_percentile(50), 150)
+        self.assertEqual(tracker.get_percentile(100), 199)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=20, capacity=2)
+        self.assertTrue(bucket.acquire(0))
+        self.assertTrue(bucket.acquire(0))
+        self.assertFalse(bucket.acquire(0))
+        started = time.time()
+        self.assertTrue(bucket.acquire())
+        self.assertTrue(time.time() - started >= 0.04)
+
+    def test_token_bucket_pause(self):
+        bucket = TokenBucket(rate=1000, capacity=5)
+        bucket.pause(0.05)
+        self.assertFalse(bucket.acquire(0.01))
+        started = time.time()
+        self.assertTrue(bucket.acquire())
+        self.assertTrue(time.time() - started >= 0.03)
+
+    def test_duplicate_filter(self):
+        duplicates = DuplicateFilter(window=0.05, max_size=2)
+        self.assertFalse(duplicates.is_duplicate('a', '#x'))
+        self.assertTrue(duplicates.is_duplicate('a', '#x'))
+        self.assertTrue(duplicates.is_duplicate('a', '#y'))
+        self.assertEqual(duplicates.take_suppressed('#x'), 1)
+        self.assertEqual(duplicates.take_suppressed('#x'), 0)
+        duplicates.add_suppressed(2, '#y')
+        self.assertEqual(duplicates.take_suppressed('#y'), 3)
+        duplicates.forget('a')
+        self.assertFalse(duplicates.is_duplicate('a'))
+        time.sleep(0.06)
+        self.assertFalse(duplicates.is_duplicate('a'))
+
+    def test_duplicate_filter_is_bounded(self):
+        duplicates = DuplicateFilter(window=60, max_size=2)
+        for key in ('a', 'b', 'c'):
+            duplicates.is_duplicate(key)
+        self.assertTrue(duplicates.is_duplicate('c'))
+        self.assertFalse(duplicates.is_duplicate('a'))
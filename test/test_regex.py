@@ -0,0 +1,41 @@
+__author__ = 'tinglev@kth.se'
+
+import re
+import unittest
+from everest_util.regex import Regex
+
+class RegexTests(unittest.TestCase):
+
+    def test_get_compiled(self):
+        pattern = Regex.get_compiled(Regex.get_static_version_regex())
+        self.assertIs(pattern, Regex.get_compiled(Regex.get_static_version_regex()))
+        self.assertTrue(pattern.match('1.2.3_abc'))
+        self.assertFalse(pattern.match('latest'))
+
+    def test_parse_image_reference(self):
+        image = 'kthregistry.sys.kth.se/kth-azure-app:1.0.0_abc'
+        self.assertEqual(Regex.parse_image_reference(image),
+                         ('kthregistry.sys.kth.se', 'kth-azure-app', '1.0.0_abc'))
+        self.assertEqual(Regex.parse_image_reference('redis:4.0'), (None, 'redis', '4.0'))
+        self.assertEqual(Regex.parse_image_reference('kth-azure-app:${WEB_VERSION}'),
+                         (None, 'kth-azure-app', '${WEB_VERSION}'))
+        self.assertIsNone(Regex.parse_image_reference('redis'))
+
+    def test_parse_registry_repository(self):
+        self.assertEqual(Regex.parse_registry_repository('kthregistry.sys.kth.se', 'app'),
+                         ('kthregistry.sys.kth.se', 'app'))
+        self.assertEqual(Regex.parse_registry_repository('host:5000/team/sub', 'app'),
+                         ('host:5000', 'team/sub/app'))
+        self.assertEqual(Regex.parse_registry_repository(None, 'redis'), (None, 'redis'))
+
+    def test_parse_image_reference_matches_separate_regexes(self):
+        images = ['registry.kth.se/app:1.0.0', 'host:5000/team/app:2.1', 'a:1/b', 'reg/app:1:2',
+                  'redis:4.0', 'redis', '/app:1.0']
+        for image in images:
+            registry = re.match(Regex.get_image_and_registry_regex(), image)
+            parts = re.match(Regex.get_image_parts_regex(), image)
+            expected = None
+            if parts:
+                expected = (registry.group(1) if registry else None,
+                            parts.group(2), parts.group(3))
+            self.assertEqual(Regex.parse_image_reference(image), expected, image)
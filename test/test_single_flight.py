@@ -0,0 +1,57 @@
+__author__ = 'tinglev@kth.se'
+
+import threading
+import time
+import unittest
+from everest_util.single_flight import SingleFlight, SingleFlightTimeoutException
+
+class SingleFlightTests(unittest.TestCase):
+
+    def _run_concurrently(self, flight, func, count=5):
+        results = []
+        def call():
+            try:
+                results.append(flight.do('key', func))
+            except ValueError as val_err:
+                results.append(val_err)
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_do_shares_result(self):
+        flight = SingleFlight()
+        calls = []
+        def func():
+            calls.append(1)
+            time.sleep(0.2)
+            return ['1.0.0']
+        results = self._run_concurrently(flight, func)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['1.0.0']] * 5)
+        self.assertEqual(flight.in_flight(), 0)
+        flight.do('key', func)
+        self.assertEqual(len(calls), 2)
+
+    def test_do_shares_exception(self):
+        flight = SingleFlight()
+        error = ValueError('failed')
+        def func():
+            time.sleep(0.2)
+            raise error
+        results = self._run_concurrently(flight, func)
+        self.assertEqual(results, [error] * 5)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_do_within_timeout(self):
+        flight = SingleFlight()
+        leader = threading.Thread(target=flight.do, args=('key', time.sleep, 0.3))
+        leader.start()
+        while not flight.in_flight():
+            time.sleep(0.01)
+        self.assertRaises(SingleFlightTimeoutException, flight.do_within, 'key', 0.05,
+                          time.sleep, 0)
+        self.assertEqual(flight.do_within('key', 1, time.sleep, 0), None)
+        leader.join()
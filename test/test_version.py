@@ -1,8 +1,11 @@
 __author__ = 'tinglev@kth.se'
 
+import random
 import unittest
 from mock import patch
-from everest_util.version import Version, VersionException
+from everest_util import version
+from everest_util.version import (Version, VersionException, VersionIndex, ParsedVersion,
+                                  VersionArray)
 
 class VersionTests(unittest.TestCase):
 
@@ -78,3 +81,136 @@ class VersionTests(unittest.TestCase):
         semver = '^0.0.0'
         result = Version.get_best_semver_match(sorted_versions, semver)
         self.assertEqual(result, '0.5.6')
+
+    def test_get_best_semver_match_equals_version_index(self):
+        versions = Version.get_sorted_valid_versions(
+            ['{}.{}.{}_{}'.format(i % 7, i % 5, i % 11, i) for i in range(300)])
+        index = VersionIndex(versions)
+        for semver in ['^0.0.0', '^3.0.0', '~4.2.0', '~6.4.0', '^7.0.0', '~1.9.0']:
+            try:
+                expected = index.best_match(semver)
+            except VersionException:
+                self.assertRaises(VersionException, Version.get_best_semver_match,
+                                  versions, semver)
+                continue
+            self.assertEqual(Version.get_best_semver_match(versions, semver), expected)
+
+    def test_get_best_semver_match_errors(self):
+        sorted_versions = ['2.6.0', '1.0.1']
+        self.assertRaises(VersionException, Version.get_best_semver_match,
+                          sorted_versions, '2.6.0')
+        self.assertRaises(VersionException, Version.get_best_semver_match,
+                          sorted_versions, '^3.0.0')
+        self.assertRaises(VersionException, Version.get_best_semver_match,
+                          sorted_versions, '~2.5.0')
+
+    def test_version_index_best_match(self):
+        index = VersionIndex(['10.4.3', '2.6.0_abc', '2.5.10', '2.5.9', '0.5.6'])
+        self.assertEqual(index.best_match('^2.0.0'), '2.6.0_abc')
+        self.assertEqual(index.best_match('~2.5.0'), '2.5.10')
+        self.assertEqual(index.best_match('~10.4.0_abc'), '10.4.3')
+        self.assertRaises(VersionException, index.best_match, '~2.4.0')
+        self.assertRaises(VersionException, index.best_match, 'latest')
+
+    def test_version_index_keeps_first_of_equal_versions(self):
+        index = VersionIndex(['1.0.1_def', '1.0.1_abc', '1.0.0'])
+        self.assertEqual(index.best_match('^1.0.0'), '1.0.1_def')
+        self.assertEqual(index.best_match('~1.0.0'), '1.0.1_def')
+
+    def test_parsed_version_parse(self):
+        parsed = ParsedVersion.parse('1.20.3_abc1234')
+        self.assertEqual(parsed.sort_key(), (1, 20, 3))
+        self.assertEqual(parsed.suffix, '_abc1234')
+        self.assertEqual(parsed.version, '1.20.3_abc1234')
+        self.assertEqual(ParsedVersion.parse('0.1.0').suffix, '')
+        self.assertIsNone(ParsedVersion.parse('latest'))
+        self.assertIsNone(ParsedVersion.parse('~1.0.0'))
+
+    def test_parsed_version_is_memoized(self):
+        self.assertIs(ParsedVersion.parse('3.2.1_abc'), ParsedVersion.parse('3.2.1_abc'))
+
+    def test_get_sorted_valid_versions_is_stable(self):
+        versions = ['1.0.1_def', '1.0.1_abc', '1.0.10', '1.0.2']
+        result = Version.get_sorted_valid_versions(versions)
+        self.assertEqual(result, ['1.0.10', '1.0.2', '1.0.1_def', '1.0.1_abc'])
+
+    def test_resolve_many(self):
+        tags = ['latest', '2.5.1', '10.4.3', '2.6.0', '1.0.1']
+        result = Version.resolve_many(tags, ['^2.0.0', '~2.5.0', '^3.0.0', 'bad', '^2.0.0'])
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result['^2.0.0'], '2.6.0')
+        self.assertEqual(result['~2.5.0'], '2.5.1')
+        self.assertIsInstance(result['^3.0.0'], VersionException)
+        self.assertIsInstance(result['bad'], VersionException)
+
+    @unittest.skipIf(version.numpy is None, 'numpy is not installed')
+    def test_version_array_matches_pure_python(self):
+        rand = random.Random(1)
+        tags = ['{}.{}.{}_{}'.format(rand.randint(0, 4), rand.randint(0, 9),
+                                     rand.randint(0, 30), rand.randint(0, 2))
+                for _ in range(2000)] + ['latest', '1.2']
+        array = VersionArray(tags)
+        index = VersionIndex(tags)
+        self.assertEqual(array.get_sorted_versions(),
+                         [parsed.version for parsed in Version.get_sorted_parsed_versions(tags)])
+        for semver in ['^0.0.0', '^3.1.0', '~2.4.0', '~4.9.1', '^5.0.0', '~1.10.0']:
+            try:
+                expected = index.best_match(semver)
+            except VersionException:
+                self.assertRaises(VersionException, array.best_match, semver)
+                continue
+            self.assertEqual(array.best_match(semver), expected)
+
+    @unittest.skipIf(version.numpy is None, 'numpy is not installed')
+    def test_get_sorted_valid_versions_uses_numpy(self):
+        versions = ['1.0.0', '2.6.0', '1.0.1', '2.5.1', '10.4.3', '0.5.6', 'invalid']
+        with patch.object(Version, 'NUMPY_MIN_VERSIONS', 1):
+            result = Version.get_sorted_valid_versions(versions)
+        self.assertEqual(result, ['10.4.3', '2.6.0', '2.5.1', '1.0.1', '1.0.0', '0.5.6'])
+
+    @unittest.skipIf(version.numpy is None, 'numpy is not installed')
+    def test_get_sorted_valid_versions_with_huge_version_parts(self):
+        versions = ['1.0.0', '20180101120000123456789.0.1', '2.0.0', 'invalid']
+        self.assertRaises(VersionException, VersionArray, versions)
+        with patch.object(Version, 'NUMPY_MIN_VERSIONS', 1):
+            result = Version.get_sorted_valid_versions(versions)
+        self.assertEqual(result, ['20180101120000123456789.0.1', '2.0.0', '1.0.0'])
+
+    @unittest.skipIf(version.numpy is None, 'numpy is not installed')
+    def test_create_index_uses_numpy_for_long_lists(self):
+        versions = ['1.0.0', '2.6.0', '1.0.1', '2.5.1', 'invalid']
+        self.assertIsInstance(Version.create_index(versions), VersionIndex)
+        with patch.object(Version, 'NUMPY_MIN_VERSIONS', 1):
+            self.assertIsInstance(Version.create_index(versions), VersionArray)
+            self.assertEqual(Version.resolve_many(versions, ['^2.0.0', '~1.0.0', '^3.0.0'])
+                             ['^2.0.0'], '2.6.0')
+            self.assertIsInstance(Version.create_index(versions + ['1{}.0.0'.format('0' * 20)]),
+                                  VersionIndex)
+
+    def test_version_array_without_numpy(self):
+        with patch.object(version, 'numpy', None):
+            self.assertRaises(VersionException, VersionArray, ['1.0.0'])
+            self.assertEqual(Version.get_sorted_valid_versions(['1.0.0', '1.0.1']),
+                             ['1.0.1', '1.0.0'])
+            with patch.object(Version, 'NUMPY_MIN_VERSIONS', 1):
+                self.assertIsInstance(Version.create_index(['1.0.0']), VersionIndex)
+
+    def test_stream_best_matches(self):
+        tags = (tag for tag in ['latest', '2.5.1', '10.4.3', '2.6.0_b', '2.6.0_a', '1.0.1'])
+        semvers = ['^2.0.0', '^2.5.0', '~2.5.0', '^3.0.0', 'bad', '~10.4.1']
+        result = Version.stream_best_matches(tags, semvers)
+        self.assertEqual(result['^2.0.0'], '2.6.0_b')
+        self.assertEqual(result['^2.5.0'], '2.6.0_b')
+        self.assertEqual(result['~2.5.0'], '2.5.1')
+        self.assertEqual(result['~10.4.1'], '10.4.3')
+        self.assertIsInstance(result['^3.0.0'], VersionException)
+        self.assertIsInstance(result['bad'], VersionException)
+        tags = ['latest', '2.5.1', '10.4.3', '2.6.0_b', '2.6.0_a', '1.0.1']
+        self.assertEqual(Version.stream_best_matches(tags, ['^2.0.0', '~2.5.0']),
+                         Version.resolve_many(tags, ['^2.0.0', '~2.5.0']))
+
+    def test_stream_best_matches_does_not_memoize(self):
+        with patch.dict(ParsedVersion._cache, clear=True):
+            tags = ('{}.0.0'.format(major) for major in range(1000))
+            self.assertEqual(Version.stream_best_matches(tags, ['^7.0.0']), {'^7.0.0': '7.0.0'})
+            self.assertEqual(ParsedVersion._cache, {})